@@ -1,12 +1,24 @@
-from fastapi import APIRouter, HTTPException, Depends, Query, Request
-from sqlalchemy.orm import Session
-from db.session import get_db
+from fastapi import APIRouter, HTTPException, Query, Request, Response
 from typing import Optional
+from api.responses import dumps
+from logging_setup import NAVIGATION_LOGGER_NAME
+from services.response_cache import LRUCache
+import logging
+import time
+
+logger = logging.getLogger(NAVIGATION_LOGGER_NAME)
+
+# Serialized /navigate responses keyed by the exact endpoints and the
+# departure: the requested HH:MM:SS, or the current minute when none is given.
+# The payload echoes the caller's coordinates, departure time and the walk
+# legs from them, so requests differing in any of these must not share an entry.
+NAVIGATION_CACHE_TTL_SECONDS = 60
+navigation_cache = LRUCache(maxsize=10_000, ttl=NAVIGATION_CACHE_TTL_SECONDS)
 
 router = APIRouter()
 
 @router.get("/navigate")
-async def navigate(
+def navigate(
     request: Request,
     origin_lat: float = Query(..., description="Origin latitude"),
     origin_lon: float = Query(..., description="Origin longitude"),
@@ -14,10 +26,12 @@ async def navigate(
     dest_lon: float = Query(..., description="Destination longitude"),
     departure_time: Optional[str] = Query(None, description="Departure time in HH:MM:SS format"),
     debug: bool = Query(False, description="Enable debug logs"),
-    db: Session = Depends(get_db)
 ):
     """
     Find routes from origin to destination using the pre-loaded NavigationService.
+
+    Declared with plain def so FastAPI runs the (CPU-bound) search in its
+    threadpool instead of blocking the event loop.
     """
     
     # 1. Coordinate Validation
@@ -28,12 +42,26 @@ async def navigate(
     
     # 2. Time Parsing
     if departure_time:
-        try:
-            parts = departure_time.split(':')
-            if len(parts) != 3: raise ValueError()
-            h, m, s = int(parts[0]), int(parts[1]), int(parts[2])
-        except:
+        # Strictly HH:MM:SS; hours may be 24 or more, as in GTFS times
+        parts = departure_time.split(':')
+        if len(parts) != 3 or not all(p.isascii() and p.isdigit() for p in parts):
             raise HTTPException(status_code=400, detail="Invalid departure_time format. Use HH:MM:SS")
+        h, m, s = int(parts[0]), int(parts[1]), int(parts[2])
+        if m > 59 or s > 59:
+            raise HTTPException(status_code=400, detail="Invalid departure_time format. Use HH:MM:SS")
+        # Canonical HH:MM:SS for the service and the cache key
+        departure_time = f"{h:02d}:{m:02d}:{s:02d}"
+
+    # Same trip for the same departure time -> same answer; "now" requests
+    # share an answer within the current minute. Debug responses carry per-run
+    # logs, so they are never cached.
+    cache_key = None
+    if not debug:
+        departure_key = departure_time if departure_time else int(time.time()) // 60
+        cache_key = (origin_lat, origin_lon, dest_lat, dest_lon, departure_key)
+        payload = navigation_cache.get(cache_key)
+        if payload is not None:
+            return Response(content=payload, media_type="application/json")
 
     try:
         # Use the NavigationService that was loaded at startup
@@ -48,23 +76,24 @@ async def navigate(
             departure_time=departure_time,
             debug=debug
         )
-        
-        return result
+
+        payload = dumps(result)
+        if cache_key is not None:
+            navigation_cache.set(cache_key, payload)
+
+        return Response(content=payload, media_type="application/json")
     
-    except Exception as e:
-        print(f"Navigation Error: {e}")
-        import traceback
-        traceback.print_exc()
-        raise HTTPException(status_code=500, detail=f"Navigation error: {str(e)}")
+    except Exception:
+        logger.exception("navigate failed")
+        raise HTTPException(status_code=500, detail="Navigation error")
 
 
 @router.get("/nearby-stops")
-async def get_nearby_stops(
+def get_nearby_stops(
     request: Request,
     lat: float = Query(..., description="Latitude"),
     lon: float = Query(..., description="Longitude"),
     max_distance: int = Query(500, description="Maximum distance in meters"),
-    db: Session = Depends(get_db)
 ):
     """Find stops near a location"""
     raptor_service = request.app.state.raptor_service
@@ -78,11 +107,10 @@ async def get_nearby_stops(
 
 
 @router.get("/debug-metro")
-async def debug_metro(
+def debug_metro(
     request: Request,
     origin_lat: float = Query(..., description="Origin latitude"),
     origin_lon: float = Query(..., description="Origin longitude"),
-    db: Session = Depends(get_db)
 ):
     """Debug metro accessibility"""
     raptor_service = request.app.state.raptor_service
@@ -90,30 +118,31 @@ async def debug_metro(
     nearby_stops = raptor_service.find_nearby_stops(origin_lat, origin_lon, 500)
     metro_stops = [s for s in nearby_stops if s['stop_id'].startswith('M')]
     
-    route_prefixes = {}
-    trips_with_m312 = []
-    
     timetable = raptor_service.timetable
-    trips_by_route = timetable.stop_times_by_trip
-    
-    for trip_id, stop_times in trips_by_route.items():
-        trip = timetable.trips.get(trip_id)
-        if trip and hasattr(trip, 'route_id'):
-            route_id = trip.route_id
-            prefix = route_id[:2] if len(route_id) >= 2 else route_id
-            route_prefixes[prefix] = route_prefixes.get(prefix, 0) + 1
-            
-            if any(st.stop_id == 'M312' for st in stop_times):
-                trips_with_m312.append({
-                    'trip_id': trip_id,
-                    'route_id': route_id,
-                    'stop_count': len(stop_times)
-                })
-    
+
     return {
         'nearby_stops_total': len(nearby_stops),
         'metro_stops_found': len(metro_stops),
-        'total_trips_in_system': len(trips_by_route),
-        'route_id_prefixes': dict(sorted(route_prefixes.items(), key=lambda x: x[1], reverse=True)[:10]),
-        'trips_servicing_m312': len(trips_with_m312)
-    }
\ No newline at end of file
+        'total_trips_in_system': len(timetable.stop_times_by_trip),
+        'route_id_prefixes': request.app.state.route_prefix_histogram,
+        'trips_servicing_m312': len(timetable.trips_by_stop.get('M312', ()))
+    }
+
+
+def warm_debug_metro_index(app):
+    """Top route id prefixes by trip count, computed once for /debug-metro"""
+    timetable = app.state.timetable
+    route_prefixes = {}
+
+    for trip_id in timetable.stop_times_by_trip:
+        trip = timetable.trips.get(trip_id)
+        if not (trip and hasattr(trip, 'route_id')):
+            continue
+
+        route_id = trip.route_id
+        prefix = route_id[:2] if len(route_id) >= 2 else route_id
+        route_prefixes[prefix] = route_prefixes.get(prefix, 0) + 1
+
+    app.state.route_prefix_histogram = dict(
+        sorted(route_prefixes.items(), key=lambda x: x[1], reverse=True)[:10]
+    )
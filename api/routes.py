@@ -1,14 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from db.connection import get_db
-from services.routes_service import RoutesService
+from fastapi import APIRouter, HTTPException, Request
 
 router = APIRouter(prefix="/routes", tags=["routes"])
 
 @router.get("/{route_id}/reallife-id")
-def get_reallife_route_id(route_id: str, db: Session = Depends(get_db)):
-    service = RoutesService(db)
-    real_id = service.get_reallife_id(route_id)
+def get_reallife_route_id(route_id: str, request: Request):
+    # Warmed at startup, see api/static_cache.py
+    real_id = request.app.state.reallife_id_map.get(route_id)
 
     if real_id is None:
         raise HTTPException(status_code=404, detail="Route not found")
@@ -0,0 +1,18 @@
+from fastapi import FastAPI
+from db.connection import SessionLocal
+from services.routes_service import RoutesService
+from api.stops import stream_all_stops
+
+
+def warm_static_caches(app: FastAPI):
+    """
+    Build the responses that only change when GTFS is reloaded and keep
+    them on app.state: the serialized stop list and the reallife id map.
+    """
+    app.state.stops_payload_bytes = b"".join(stream_all_stops())
+
+    db = SessionLocal()
+    try:
+        app.state.reallife_id_map = RoutesService(db).get_reallife_id_map()
+    finally:
+        db.close()
@@ -1,32 +1,81 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
 from sqlalchemy.orm import Session
-from db.connection import get_db
+from db.connection import get_db, SessionLocal
 from db.models import Stop, StopTime
+from api.responses import ORJSONResponse, dumps
 from services.stops_service import StopsService
+from services.response_cache import LRUCache
 from datetime import datetime, timedelta
+from logging_setup import DEBUG_LOGGER_NAME
+import logging
+import time
+
+debug_logger = logging.getLogger(DEBUG_LOGGER_NAME)
+
+# (stop_code, minute bucket) -> serialized future arrivals
+future_arrivals_cache = LRUCache(maxsize=4096)
 
 router = APIRouter(prefix="/stops", tags=["stops"])
 
 
+def stream_all_stops():
+    """Yield the stop list as a JSON array, one serialized batch at a time"""
+    # The generator outlives the request handler, so it owns its session
+    db = SessionLocal()
+    try:
+        yield b"["
+        first = True
+        for batch in StopsService(db).iter_all_stops():
+            if not batch:
+                continue
+            if not first:
+                yield b","
+            # Strip the brackets of each batch's array to splice them together
+            yield dumps(batch)[1:-1]
+            first = False
+        yield b"]"
+    finally:
+        db.close()
+
+
 @router.get("/")
-def get_all_stops(db: Session = Depends(get_db)):
-    service = StopsService(db)
-    stops = service.get_all_stops()
-    return [
-    {
-        "stop_id": stop.stop_id,
-        "stop_code": stop.stop_code if stop.stop_code else stop.stop_id[1:],
-        "stop_name": stop.stop_name,
-        "stop_desc": stop.stop_desc,
-        "stop_lat": stop.stop_lat,
-        "stop_lon": stop.stop_lon,
-        "location_type": stop.location_type,
-        "parent_station": stop.parent_station,
-        "stop_timezone": stop.stop_timezone,
-        "level_id": stop.level_id,
-    }
-    for stop in stops
-    ]
+def get_all_stops(request: Request):
+    # Pre-serialized at startup, see api/static_cache.py
+    return Response(
+        content=request.app.state.stops_payload_bytes,
+        media_type="application/json",
+    )
+
+@router.get("/future-arrivals")
+def get_future_arrivals_for_stops(
+    stop_codes: list[str] = Query(...),
+    db: Session = Depends(get_db),
+):
+    """Future arrivals for several stops in one request, keyed by stop code"""
+    stop_codes = list(dict.fromkeys(stop_codes))
+
+    # Shares the per-stop cache with /{stop_code}/future-arrivals; only the
+    # stops missing from it are looked up, all in one batch
+    minute_bucket = int(time.time()) // 60
+    payloads = {}
+    for stop_code in stop_codes:
+        payload = future_arrivals_cache.get((stop_code, minute_bucket))
+        if payload is not None:
+            payloads[stop_code] = payload
+
+    missing = [stop_code for stop_code in stop_codes if stop_code not in payloads]
+    if missing:
+        arrivals_by_stop = StopsService(db).get_future_arrivals_for_stops(missing)
+        for stop_code in missing:
+            payload = dumps(arrivals_by_stop[stop_code])
+            future_arrivals_cache.set((stop_code, minute_bucket), payload)
+            payloads[stop_code] = payload
+
+    # Splice the serialized per-stop arrays into one JSON object
+    content = b"{" + b",".join(
+        dumps(stop_code) + b":" + payloads[stop_code] for stop_code in stop_codes
+    ) + b"}"
+    return Response(content=content, media_type="application/json")
 
 @router.get("/{stop_id}/arrivals")
 def get_arrivals(stop_id: str, db: Session = Depends(get_db)):
@@ -35,28 +84,59 @@ def get_arrivals(stop_id: str, db: Session = Depends(get_db)):
     if not arrivals:
         raise HTTPException(status_code=404, detail="No arrivals found for this stop")
 
-    return [
-        {
-            "trip_id": a.trip_id,
-            "arrival_time": a.arrival_time,
-            "departure_time": a.departure_time,
-            "stop_sequence": a.stop_sequence,
-            "stop_headsign": a.stop_headsign,
-            "pickup_type": a.pickup_type,
-            "drop_off_type": a.drop_off_type,
-            "shape_dist_traveled": a.shape_dist_traveled,
-            "continuous_pickup": a.continuous_pickup,
-            "continuous_drop_off": a.continuous_drop_off,
-            "timepoint": a.timepoint,
-        }
-        for a in arrivals
-    ]
+    return ORJSONResponse(content=arrivals)
 
 @router.get("/{stop_code}/future-arrivals")
-def get_future_arrivals(stop_code: str, db: Session = Depends(get_db)):
+def get_future_arrivals(
+    stop_code: str,
+    debug: bool = Query(False),
+    db: Session = Depends(get_db),
+):
+    # Debug requests always hit the DB so the log reflects a real lookup
+    if debug:
+        return Response(
+            content=dumps(_compute_future_arrivals(stop_code, db, debug=True)),
+            media_type="application/json",
+        )
+
+    # Clients poll the same stops constantly; serve repeats within the
+    # same minute from memory
+    minute_bucket = int(time.time()) // 60
+    cache_key = (stop_code, minute_bucket)
+
+    payload = future_arrivals_cache.get(cache_key)
+    if payload is None:
+        payload = dumps(_compute_future_arrivals(stop_code, db))
+        future_arrivals_cache.set(cache_key, payload)
+
+    return Response(content=payload, media_type="application/json")
+
+
+def _compute_future_arrivals(stop_code: str, db: Session, debug: bool = False):
     service = StopsService(db)
-    
-    # Debug logging to file
+
+    if debug:
+        _log_stop_debug_info(stop_code, db)
+
+    arrivals = service.get_future_arrivals_by_stop(stop_code)
+
+    if debug:
+        debug_msg = f"Future arrivals returned: {len(arrivals)}\n"
+        if arrivals:
+            debug_msg += f"First 3 arrivals:\n"
+            for arr in arrivals[:3]:
+                debug_msg += f"  - {arr.get('real_life_route_id', 'N/A')} at {arr.get('scheduled_arrival_time', 'N/A')}\n"
+        debug_msg += f"=== END REQUEST ==="
+        debug_logger.debug(debug_msg)
+
+    if not arrivals:
+        return []
+
+    return arrivals
+
+
+def _log_stop_debug_info(stop_code: str, db: Session):
+    """Extra lookups for ?debug=true, written to metro_debug.log off-thread"""
     now = datetime.now()
     current_time = now.strftime("%H:%M:%S")
     
@@ -73,24 +153,6 @@ def get_future_arrivals(stop_code: str, db: Session = Depends(get_db)):
     
     # Show sample times
     samples = db.query(StopTime).filter(StopTime.stop_id == stop_code).limit(5).all()
-    debug_msg += f"Sample arrival times: {[s.arrival_time for s in samples]}\n"
+    debug_msg += f"Sample arrival times: {[s.arrival_time for s in samples]}"
     
-    with open("metro_debug.log", "a") as f:
-        f.write(debug_msg)
-    
-    arrivals = service.get_future_arrivals_by_stop(stop_code)
-    
-    debug_msg = f"Future arrivals returned: {len(arrivals)}\n"
-    if arrivals:
-        debug_msg += f"First 3 arrivals:\n"
-        for arr in arrivals[:3]:
-            debug_msg += f"  - {arr.get('real_life_route_id', 'N/A')} at {arr.get('scheduled_arrival_time', 'N/A')}\n"
-    debug_msg += f"=== END REQUEST ===\n"
-    
-    with open("metro_debug.log", "a") as f:
-        f.write(debug_msg)
-
-    if not arrivals:
-        return []
-
-    return arrivals
\ No newline at end of file
+    debug_logger.debug(debug_msg)
@@ -1,6 +1,6 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from db.session import get_db
+from db.connection import get_db
 from services.trips_service import TripsService
 
 router = APIRouter(prefix="/trips", tags=["trips"])
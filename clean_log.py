@@ -10,36 +10,43 @@ print("🚀 Starting incremental cleaning...")
 df_raw = pd.read_csv(RAW_FILE)
 print(f"Loaded {len(df_raw)} rows from raw log")
 
-# --- Parse timestamps safely ---
-def parse_timestamp_safe(x):
-    if pd.isna(x):
-        return pd.NaT
-    try:
-        x = str(x).replace("EEST", "").replace("EET", "").strip()
-        return pd.to_datetime(x, errors="coerce", utc=True)
-    except Exception:
-        return pd.NaT
-
-df_raw["timestamp"] = df_raw["timestamp"].apply(parse_timestamp_safe)
+# --- Parse timestamps (vectorized) ---
+timestamps = (
+    df_raw["timestamp"]
+    .astype("string")
+    .str.replace("EEST", "", regex=False)
+    .str.replace("EET", "", regex=False)
+    .str.strip()
+)
+df_raw["timestamp"] = pd.to_datetime(timestamps, errors="coerce", utc=True, format="mixed")
 
 # Track broken timestamps
 before_timestamp = len(df_raw)
 df_raw = df_raw.dropna(subset=["timestamp"])
 removed_broken = before_timestamp - len(df_raw)
 
-# --- Load existing clean data (if any) ---
-if os.path.exists(CLEAN_FILE):
-    df_clean_existing = pd.read_csv(CLEAN_FILE)
-    if "timestamp" in df_clean_existing.columns:
-        df_clean_existing["timestamp"] = pd.to_datetime(df_clean_existing["timestamp"], utc=True, errors="coerce")
-        last_clean_time = df_clean_existing["timestamp"].max()
+# --- Find where the previous clean run stopped (if any) ---
+# Only the header and the timestamp column are read; the cleaned rows
+# themselves are never loaded again, new rows are appended below
+# Appending is only safe when we know where the clean file ends; otherwise
+# everything is cleaned again and the file rewritten, so no row is doubled
+clean_columns = None
+append = False
+if os.path.exists(CLEAN_FILE) and os.path.getsize(CLEAN_FILE) > 0:
+    clean_columns = list(pd.read_csv(CLEAN_FILE, nrows=0).columns)
+    if "timestamp" in clean_columns:
+        clean_timestamps = pd.read_csv(CLEAN_FILE, usecols=["timestamp"])["timestamp"]
+        last_clean_time = pd.to_datetime(clean_timestamps, utc=True, errors="coerce", format="mixed").max()
         print(f"🕒 Last cleaned timestamp: {last_clean_time}")
-        df_raw = df_raw[df_raw["timestamp"] > last_clean_time]
-        print(f"🧩 Found {len(df_raw)} new rows since last clean")
+        if pd.notna(last_clean_time):
+            df_raw = df_raw[df_raw["timestamp"] > last_clean_time]
+            append = True
+            print(f"🧩 Found {len(df_raw)} new rows since last clean")
+        else:
+            print("⚠️ No valid timestamp in the clean file, cleaning everything.")
     else:
         print("⚠️ Clean file has no timestamp column, cleaning everything.")
 else:
-    df_clean_existing = pd.DataFrame()
     print("📁 No previous clean file found — cleaning all data")
 
 if df_raw.empty:
@@ -50,7 +57,11 @@ if df_raw.empty:
 
 # Drop duplicates (vehicle_id + trip_id + stop_id)
 before = len(df_raw)
-df_raw = df_raw.drop_duplicates(subset=["vehicle_id", "trip_id", "stop_id"])
+# Hash the composite key into one uint64 column and dedupe on that
+dedupe_key = pd.util.hash_pandas_object(
+    df_raw[["vehicle_id", "trip_id", "stop_id"]].astype("category"), index=False
+)
+df_raw = df_raw[~dedupe_key.duplicated().to_numpy()]
 removed_dupes = before - len(df_raw)
 
 # Remove unrealistic delays (outside ±2h)
@@ -63,12 +74,13 @@ else:
     print("⚠️ No 'delay_seconds' column found, skipping delay filter.")
 
 # --- Append cleaned new data to existing file ---
-if not df_clean_existing.empty:
-    df_final = pd.concat([df_clean_existing, df_raw], ignore_index=True)
+if append:
+    # Keep the existing column order so appended rows line up with the header
+    df_raw.reindex(columns=clean_columns).to_csv(
+        CLEAN_FILE, mode="a", header=False, index=False, encoding="utf-8"
+    )
 else:
-    df_final = df_raw
-
-df_final.to_csv(CLEAN_FILE, index=False, encoding="utf-8")
+    df_raw.to_csv(CLEAN_FILE, index=False, encoding="utf-8")
 
 # --- Summary ---
 print("\n✅ Cleaning complete!")
@@ -76,4 +88,4 @@ print(f"🧹 Removed {removed_broken} broken-day rows")
 print(f"🗑 Removed {removed_dupes} duplicates")
 print(f"🚫 Removed {removed_unrealistic} unrealistic delays (>|2h|)")
 print(f"📈 Appended {len(df_raw)} new cleaned rows")
-print(f"💾 Total rows in clean file: {len(df_final)}")
+print(f"💾 Clean file: {CLEAN_FILE}")
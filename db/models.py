@@ -1,6 +1,26 @@
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Column, Computed, String, Integer, Index
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateIndex
 from .connection import Base
 
+
+def _gtfs_seconds(column_name: str) -> Computed:
+    """Stored HH:MM:SS -> seconds conversion (GTFS hours may exceed 23)"""
+    h, m, s = (
+        f"NULLIF(split_part(trim({column_name}), ':', {i}), '')::int"
+        for i in (1, 2, 3)
+    )
+    return Computed(f"{h} * 3600 + {m} * 60 + {s}", persisted=True)
+
+
+# Stop codes are matched on the last STOP_CODE_LENGTH characters of stop_id,
+# case-insensitively; stored so the match is an equality an index can serve
+STOP_CODE_LENGTH = 4
+
+
+def _stop_code(column_name: str) -> Computed:
+    return Computed(f"lower(right({column_name}, {STOP_CODE_LENGTH}))", persisted=True)
+
 class Stop(Base):
     __tablename__ = "stops"
 
@@ -17,12 +37,21 @@ class Stop(Base):
     
 class StopTime(Base):
     __tablename__ = "stop_times"
+    __table_args__ = (
+        # Arrivals at a stop are looked up by stop and then time range
+        Index("ix_stoptime_stop_arrival", "stop_id", "arrival_sec"),
+        # Bus arrivals are looked up by stop code and then time range
+        Index("ix_stoptime_stop_code_arrival", "stop_code", "arrival_sec"),
+    )
 
     trip_id = Column(String, primary_key=True, index=True)
     stop_sequence = Column(Integer, primary_key=True, nullable=False)  # ADD THIS
     arrival_time = Column(String, nullable=False)
     departure_time = Column(String, nullable=False)
-    stop_id = Column(String, index=True, nullable=False)
+    arrival_sec = Column(Integer, _gtfs_seconds("arrival_time"))
+    departure_sec = Column(Integer, _gtfs_seconds("departure_time"))
+    stop_id = Column(String, nullable=False)
+    stop_code = Column(String, _stop_code("stop_id"))
     stop_headsign = Column(String, nullable=True)
     pickup_type = Column(String, nullable=True)
     drop_off_type = Column(String, nullable=True)
@@ -33,12 +62,18 @@ class StopTime(Base):
     
 class RealisticStopTime(Base):
     __tablename__ = "realistic_stop_times"
+    __table_args__ = (
+        # Arrivals at a stop are looked up by stop and then time range
+        Index("ix_realistic_stoptime_stop_arrival", "stop_id", "arrival_sec"),
+    )
 
     trip_id = Column(String, primary_key=True, index=True)
     stop_sequence = Column(Integer, primary_key=True, nullable=False)  # ADD THIS
     arrival_time = Column(String, nullable=False)
     departure_time = Column(String, nullable=False)
-    stop_id = Column(String, index=True, nullable=False)
+    arrival_sec = Column(Integer, _gtfs_seconds("arrival_time"))
+    departure_sec = Column(Integer, _gtfs_seconds("departure_time"))
+    stop_id = Column(String, nullable=False)
     stop_headsign = Column(String, nullable=True)
     pickup_type = Column(String, nullable=True)
     drop_off_type = Column(String, nullable=True)
@@ -88,4 +123,60 @@ class CalendarDate(Base):
     
     service_id = Column(String, primary_key=True)
     date = Column(String, primary_key=True)  # Format: YYYYMMDD (e.g., "20260102")
-    exception_type = Column(String)
\ No newline at end of file
+    exception_type = Column(String)
+
+
+# Bytes read from a CSV per COPY data message (psycopg2 defaults to 8 KiB),
+# for the GTFS loads in startup.py and the realistic stop times table
+COPY_CHUNK_BYTES = 1 << 20
+
+
+def csv_table_columns(table_name: str, headers) -> str:
+    """
+    Column definitions for a table recreated from a GTFS file's header: the
+    model's type where it declares a non-string one (INTEGER stop_sequence,
+    so it sorts and joins as a number), TEXT for everything else.
+    """
+    table = Base.metadata.tables.get(table_name)
+    dialect = postgresql.dialect()
+    columns = []
+    for header in headers:
+        column = table.columns.get(header) if table is not None else None
+        if column is None or column.computed is not None or isinstance(column.type, String):
+            column_type = "TEXT"
+        else:
+            column_type = column.type.compile(dialect=dialect)
+        columns.append(f'"{header}" {column_type}')
+    return ", ".join(columns)
+
+
+def post_load_ddl(table_name: str, columns) -> list[str]:
+    """
+    DDL for a table that was just recreated and COPYed from a GTFS file.
+    Tables are rebuilt as plain TEXT columns, so this adds the model's
+    generated columns and then the indexes whose columns all exist.
+    """
+    table = Base.metadata.tables.get(table_name)
+    if table is None:
+        return []
+
+    columns = set(columns)
+    dialect = postgresql.dialect()
+    statements = []
+
+    for column in table.columns:
+        if column.computed is None or column.name in columns:
+            continue
+        statements.append(
+            f"ALTER TABLE {table_name} ADD COLUMN IF NOT EXISTS {column.name} "
+            f"{column.type.compile(dialect=dialect)} "
+            f"GENERATED ALWAYS AS ({column.computed.sqltext}) STORED"
+        )
+        columns.add(column.name)
+
+    statements.extend(
+        str(CreateIndex(index, if_not_exists=True).compile(dialect=dialect))
+        for index in sorted(table.indexes, key=lambda i: i.name)
+        if all(col.name in columns for col in index.columns)
+    )
+    return statements
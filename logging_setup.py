@@ -0,0 +1,38 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# Debug output of the stop endpoints, written by a background thread
+DEBUG_LOG_FILE = "metro_debug.log"
+DEBUG_LOGGER_NAME = "metro_debug"
+
+# Request-path errors of the navigation endpoints
+NAVIGATION_LOGGER_NAME = "navigation"
+
+
+def _queue_logger(name: str, handler: logging.Handler, level=logging.DEBUG) -> QueueListener:
+    """Route a logger through a queue so handler I/O stays off request threads"""
+    log_queue = queue.SimpleQueue()
+
+    logger = logging.getLogger(name)
+    logger.setLevel(level)
+    logger.propagate = False
+    logger.handlers = [QueueHandler(log_queue)]
+
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+
+def start_logging() -> list[QueueListener]:
+    """Start the background log writers; stop the returned listeners on shutdown"""
+    debug_handler = logging.FileHandler(DEBUG_LOG_FILE)
+    debug_handler.setFormatter(logging.Formatter("%(message)s"))
+
+    error_handler = logging.StreamHandler()
+    error_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s:%(message)s"))
+
+    return [
+        _queue_logger(DEBUG_LOGGER_NAME, debug_handler),
+        _queue_logger(NAVIGATION_LOGGER_NAME, error_handler, level=logging.INFO),
+    ]
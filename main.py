@@ -1,32 +1,39 @@
 from fastapi import FastAPI
-from contextlib import asynccontextmanager
+from contextlib import asynccontextmanager, suppress
 import asyncio
 from startup import run_startup
 from api.stops import router as stops_router
 from api.routes import router as routes_router
 from api.trips import router as trips_router
 from api.arrivals import router as arrivals_router
-from api.navigation import router as navigation_router
+from api.navigation import router as navigation_router, warm_debug_metro_index
+from api.static_cache import warm_static_caches
+from api.responses import ORJSONResponse
 from services.arrival_logger import arrival_logger
 from services.navigation_service import NavigationService
+from logging_setup import start_logging
 from dotenv import load_dotenv
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    log_listeners = start_logging()
+
     # 1. Run startup and get the initialized objects
     timetable, raptor_service = run_startup()
     
     # 2. Store them in app.state so they live as long as the server
     app.state.timetable = timetable
     app.state.raptor_service = raptor_service
+
+    # Serve the static stop list and route ids from memory
+    warm_static_caches(app)
+    warm_debug_metro_index(app)
     
     # 3. Create a NavigationService once with the loaded timetable
     # This way we don't recreate it on every request
-    from sqlalchemy.orm import sessionmaker
-    from db.connection import engine
-    SessionLocal = sessionmaker(bind=engine)
-    db_session = SessionLocal()
-    app.state.navigation_service = NavigationService(db_session)
+    app.state.navigation_service = NavigationService(
+        timetable, raptor_service, app.state.reallife_id_map
+    )
     
     # Start background tasks
     logger_task = asyncio.create_task(arrival_logger.poll_vehicles())
@@ -34,9 +41,18 @@ async def lifespan(app: FastAPI):
     yield
     
     logger_task.cancel()
-    db_session.close()
+    # Let the poller finish the feed it is processing before the log is closed
+    with suppress(asyncio.CancelledError):
+        await logger_task
+    arrival_logger.close()
+    for listener in log_listeners:
+        listener.stop()
 
-app = FastAPI(title="Sofia Transport API", lifespan=lifespan)
+app = FastAPI(
+    title="Sofia Transport API",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse,
+)
 
 # Include routers
 app.include_router(stops_router)
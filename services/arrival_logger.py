@@ -1,14 +1,19 @@
 import asyncio
 import csv
+import heapq
 import logging
 import os
-from datetime import datetime, timedelta, time as dtime
-from math import radians, sin, cos, sqrt, atan2
-from typing import Dict, Set, Optional
-from threading import Lock
+from datetime import date, datetime, timedelta, time as dtime
+from typing import Dict, Set, Optional, Tuple
+import numpy as np
+import pandas as pd
 import requests
-from google.transit import gtfs_realtime_pb2
-from google.protobuf.message import DecodeError
+from requests.adapters import HTTPAdapter
+from services.gtfs_rt import gtfs_realtime_pb2, DecodeError
+from services.vehicle_positions import (
+    VEHICLE_POSITIONS_URL, positions_from_feed, publish_vehicle_positions,
+    touch_vehicle_positions,
+)
 
 try:
     from zoneinfo import ZoneInfo
@@ -20,34 +25,131 @@ TZ = ZoneInfo("Europe/Sofia")
 POLL_INTERVAL = 5  # seconds
 REQUEST_TIMEOUT = 10  # seconds
 DISTANCE_THRESHOLD_M = 30  # meters
-GTFS_RT_URL = "https://gtfs.sofiatraffic.bg/api/v1/vehicle-positions"
+GTFS_RT_URL = VEHICLE_POSITIONS_URL  # each poll is also published as the vehicle positions
 GTFS_DIR = "gtfs_static"
 LOG_FILE = "arrival_log.csv"
 CACHE_TTL_SECONDS = 60  # Keep cached arrivals for 60 seconds after last seen
+CSV_BUFFER_SIZE = 64 * 1024
+CSV_FLUSH_EVERY = 100  # rows; the log is also flushed at the end of every poll
+DIST_THRESH_SQ = DISTANCE_THRESHOLD_M * DISTANCE_THRESHOLD_M
+MPD_LAT = 111320.0  # meters per degree of latitude
+LAT_EPS = DISTANCE_THRESHOLD_M / MPD_LAT  # threshold in degrees of latitude
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def match_arrivals(vlats: np.ndarray, vlons: np.ndarray, vtrip_idx: np.ndarray,
+                   trip_stop_ptr: np.ndarray, trip_stop_rows: np.ndarray,
+                   stop_lats: np.ndarray, stop_lons: np.ndarray,
+                   sorted_lats: np.ndarray):
+    """
+    Vehicle/stop proximity kernel over the CSR trip layout.
+    Returns (vehicle indices, flat CSR indices) of every vehicle/trip stop pair
+    closer than DISTANCE_THRESHOLD_M, ordered by vehicle then trip stop order.
+    """
+    empty = np.empty(0, dtype=np.int64)
+
+    # Vehicles with no stop at all within the threshold in latitude
+    # (e.g. between stops) are dropped by two vectorized binary searches
+    lo = np.searchsorted(sorted_lats, vlats - LAT_EPS, side="left")
+    hi = np.searchsorted(sorted_lats, vlats + LAT_EPS, side="right")
+    near = np.nonzero(hi > lo)[0]
+    if near.size == 0:
+        return empty, empty
+
+    # Expand each remaining vehicle to its trip's slice of the CSR arrays
+    starts = trip_stop_ptr[vtrip_idx[near]]
+    counts = trip_stop_ptr[vtrip_idx[near] + 1] - starts
+    total = int(counts.sum())
+    if total == 0:
+        return empty, empty
+    veh = np.repeat(near, counts)
+    positions = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    flat = np.repeat(starts, counts) + positions
+    rows = trip_stop_rows[flat]
+
+    # At 30 m a local equirectangular projection is as good as haversine,
+    # and comparing squared distances needs no trig or sqrt per pair
+    mpd_lon = MPD_LAT * np.cos(np.radians(vlats))
+    dx = (stop_lons[rows] - vlons[veh]) * mpd_lon[veh]
+    dy = (stop_lats[rows] - vlats[veh]) * MPD_LAT
+    hits = dx * dx + dy * dy < DIST_THRESH_SQ
+
+    return veh[hits], flat[hits]
+
+
+def extract_vehicles(feed, trip_index: Dict[str, int]):
+    """
+    Flatten the positioned vehicles of a feed that are on a known trip into
+    parallel lists: (trip_ids, route_ids, trip rows, lats, lons).
+    Only the handful of fields the matcher needs are read from each entity.
+    """
+    trip_ids = []
+    route_ids = []
+    trip_rows = []
+    lats = []
+    lons = []
+    for entity in feed.entity:
+        if not entity.HasField('vehicle'):
+            continue
+        vehicle = entity.vehicle
+        if not vehicle.HasField('position'):
+            continue
+        trip = vehicle.trip
+        # trip_id is used as the vehicle_id for consistency
+        trip_id = trip.trip_id
+        row = trip_index.get(trip_id) if trip_id else None
+        if row is None:
+            continue
+        position = vehicle.position
+        trip_ids.append(trip_id)
+        route_ids.append(trip.route_id if trip.HasField('route_id') else None)
+        trip_rows.append(row)
+        lats.append(position.latitude)
+        lons.append(position.longitude)
+    return trip_ids, route_ids, trip_rows, lats, lons
+
+
 class ArrivalLogger:
     """Background service that logs vehicle arrivals at stops"""
     
     def __init__(self):
-        self.vehicle_arrivals: Dict[str, Set[str]] = {}  # {trip_id: set of stop_ids}
+        self.vehicle_arrivals: Dict[str, int] = {}  # {trip_id: bitmask of logged stops, see trip_stop_bit}
         self.vehicle_latest_arrival: Dict[str, dict] = {}  # {trip_id: arrival_info with last_seen}
-        self.data_lock = Lock()
+        # Only the poll thread writes these: it builds new dicts (inner ones
+        # included) and rebinds the attributes once per poll, so readers always
+        # see a whole snapshot and never modify it
         
         # Load GTFS static data
         self.stops = self._load_stops()
-        self.trip_stops = self._load_stop_times()
+        stop_times = self._load_stop_times()
         self.trip_services = self._load_trips()
         self.service_days = self._load_calendar_dates()
+        self._build_stop_arrays(stop_times)
         
         # Initialize CSV file with header if it doesn't exist
         self._init_csv_log()
+        # One buffered handle for the process lifetime instead of open/close per row
+        self._csv_fh = open(LOG_FILE, 'a', newline='', encoding='utf-8', buffering=CSV_BUFFER_SIZE)
+        self._csv_writer = csv.writer(self._csv_fh)
+        self._csv_unflushed = 0
+        
+        # Keep-alive session so every poll reuses the TLS connection
+        self._http = requests.Session()
+        self._http.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=2))
+        # ETag / Last-Modified of the last feed, sent back so an unchanged feed is a 304
+        self._feed_validators: Dict[str, str] = {}
+        self._last_feed_trip_ids: Set[str] = set()
+        # (last_seen timestamp, trip_id) for every last_seen write; stale
+        # entries are skipped on pop, so eviction never scans the caches
+        self._ttl_heap: list[tuple[float, str]] = []
+        # Scheduled datetime of (trip_id, arrival_time) on _sched_cache_day
+        self._sched_cache: Dict[Tuple[str, int], datetime] = {}
+        self._sched_cache_day: Optional[date] = None
         
-        logger.info(f"Loaded {len(self.stops)} stops, {len(self.trip_stops)} trips")
+        logger.info(f"Loaded {len(self.stops)} stops, {len(self.trip_index)} trips")
         logger.info(f"Cache TTL: {CACHE_TTL_SECONDS} seconds")
     
     def _init_csv_log(self):
@@ -63,53 +165,117 @@ class ArrivalLogger:
         except Exception as e:
             logger.error(f"Error initializing CSV log: {e}")
     
+    @staticmethod
+    def _read_gtfs_csv(file_name: str, columns) -> pd.DataFrame:
+        """Read the given columns of a GTFS file as strings ('' for empty/missing)"""
+        columns = set(columns)
+        df = pd.read_csv(
+            f"{GTFS_DIR}/{file_name}",
+            dtype=str,
+            keep_default_na=False,
+            usecols=lambda c: c in columns,
+            encoding='utf-8',
+        )
+        for column in columns - set(df.columns):
+            df[column] = ''
+        return df
+
     def _load_stops(self) -> dict:
         """Load stops.txt"""
         stops = {}
         try:
-            with open(f"{GTFS_DIR}/stops.txt", 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    stop_id = row.get('stop_id')
-                    if stop_id and row.get('stop_lat') and row.get('stop_lon'):
-                        stops[stop_id] = {
-                            'name': row.get('stop_name', ''),
-                            'lat': float(row['stop_lat']),
-                            'lon': float(row['stop_lon'])
-                        }
+            df = self._read_gtfs_csv("stops.txt", ('stop_id', 'stop_name', 'stop_lat', 'stop_lon'))
+            df = df[(df['stop_id'] != '') & (df['stop_lat'] != '') & (df['stop_lon'] != '')]
+            lats = df['stop_lat'].astype(float).tolist()
+            lons = df['stop_lon'].astype(float).tolist()
+            for stop_id, name, lat, lon in zip(df['stop_id'].tolist(), df['stop_name'].tolist(), lats, lons):
+                stops[stop_id] = {
+                    'name': name,
+                    'lat': lat,
+                    'lon': lon
+                }
         except Exception as e:
             logger.error(f"Error loading stops: {e}")
         return stops
     
-    def _load_stop_times(self) -> dict:
-        """Load stop_times.txt"""
-        trip_stops = {}
+    def _build_stop_arrays(self, stop_times: pd.DataFrame):
+        """
+        Stops as parallel coordinate arrays (SoA) and trips' stops in CSR form:
+        the stops of trip t are the slice trip_stop_ptr[t]:trip_stop_ptr[t + 1] of
+        the parallel arrays trip_stop_rows, trip_stop_arrival_sec, trip_stop_seq
+        and trip_stop_bit, in file order. Only stops with coordinates are kept.
+        """
+        self.stop_ids = list(self.stops)
+        self.stop_index: Dict[str, int] = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        self.stop_lat_arr = np.array([s['lat'] for s in self.stops.values()], dtype=np.float64)
+        self.stop_lon_arr = np.array([s['lon'] for s in self.stops.values()], dtype=np.float64)
+        # Latitude-sorted view of the stops for the band prefilter
+        self._sorted_lat = np.sort(self.stop_lat_arr)
+
+        # Trips are numbered in order of first appearance, before dropping
+        # unknown stops, so a trip without usable stops is still a known trip
+        trip_codes, trip_ids = pd.factorize(stop_times['trip_id'])
+        self.trip_index: Dict[str, int] = {trip_id: i for i, trip_id in enumerate(trip_ids.tolist())}
+
+        stop_rows = stop_times['stop_id'].map(self.stop_index)
+        known = stop_rows.notna().to_numpy()
+        order = np.argsort(trip_codes[known], kind='stable')
+        trip_codes = trip_codes[known][order]
+        self.trip_stop_ptr = np.zeros(len(trip_ids) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(trip_codes, minlength=len(trip_ids)), out=self.trip_stop_ptr[1:])
+        self.trip_stop_rows = stop_rows.to_numpy()[known][order].astype(np.int32)
+        self.trip_stop_arrival_sec = stop_times['arrival_sec'].to_numpy()[known][order]
+        self.trip_stop_seq = stop_times['stop_sequence'].to_numpy()[known][order]
+
+        # Bit of each trip stop in the trip's "already logged" mask: the rank of
+        # the stop among the trip's distinct stops, so a repeat visit shares the bit
+        group = pd.DataFrame({'trip': trip_codes, 'stop': self.trip_stop_rows}).groupby(['trip', 'stop']).ngroup()
+        group = group.to_numpy()
+        # Groups are numbered by (trip, stop), so a trip's lowest group is its first
+        first_group = np.zeros(len(trip_ids), dtype=np.int64)
+        nonempty = self.trip_stop_ptr[1:] > self.trip_stop_ptr[:-1]
+        if nonempty.any():
+            first_group[nonempty] = np.minimum.reduceat(group, self.trip_stop_ptr[:-1][nonempty])
+        self.trip_stop_bit = (group - first_group[trip_codes]).astype(np.int64)
+
+    @staticmethod
+    def _gtfs_time_to_seconds(times: pd.Series) -> np.ndarray:
+        """HH:MM:SS (hours may exceed 23) to seconds after midnight, -1 if empty or invalid"""
+        parts = times.str.split(':', n=2, expand=True).reindex(columns=range(3))
+        h, m, s = (pd.to_numeric(parts[i], errors='coerce') for i in range(3))
+        seconds = h * 3600 + m * 60 + s
+        return seconds.fillna(-1).to_numpy(dtype=np.int32)
+
+    def _load_stop_times(self) -> pd.DataFrame:
+        """Load stop_times.txt as (trip_id, stop_id, arrival_sec, stop_sequence) in file order"""
         try:
-            with open(f"{GTFS_DIR}/stop_times.txt", 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    trip_id = row.get('trip_id')
-                    stop_id = row.get('stop_id')
-                    if trip_id and stop_id:
-                        trip_stops.setdefault(trip_id, []).append({
-                            'stop_id': stop_id,
-                            'arrival_time': row.get('arrival_time', ''),
-                            'stop_sequence': row.get('stop_sequence', '')
-                        })
+            df = self._read_gtfs_csv(
+                "stop_times.txt", ('trip_id', 'stop_id', 'arrival_time', 'stop_sequence')
+            )
+            df = df[(df['trip_id'] != '') & (df['stop_id'] != '')]
+            return pd.DataFrame({
+                'trip_id': df['trip_id'].to_numpy(),
+                'stop_id': df['stop_id'].to_numpy(),
+                'arrival_sec': self._gtfs_time_to_seconds(df['arrival_time']),
+                'stop_sequence': pd.to_numeric(df['stop_sequence'], errors='coerce')
+                                   .fillna(-1).to_numpy(dtype=np.int32),
+            })
         except Exception as e:
             logger.error(f"Error loading stop_times: {e}")
-        return trip_stops
+            return pd.DataFrame({
+                'trip_id': pd.Series(dtype=object),
+                'stop_id': pd.Series(dtype=object),
+                'arrival_sec': pd.Series(dtype=np.int32),
+                'stop_sequence': pd.Series(dtype=np.int32),
+            })
     
     def _load_trips(self) -> dict:
         """Load trips.txt"""
         trip_services = {}
         try:
-            with open(f"{GTFS_DIR}/trips.txt", 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    trip_id = row.get('trip_id')
-                    if trip_id:
-                        trip_services[trip_id] = row.get('service_id')
+            df = self._read_gtfs_csv("trips.txt", ('trip_id', 'service_id'))
+            df = df[df['trip_id'] != '']
+            trip_services = dict(zip(df['trip_id'].tolist(), df['service_id'].tolist()))
         except Exception as e:
             logger.error(f"Error loading trips: {e}")
         return trip_services
@@ -118,48 +284,39 @@ class ArrivalLogger:
         """Load calendar_dates.txt"""
         service_days = {}
         try:
-            with open(f"{GTFS_DIR}/calendar_dates.txt", 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    date_str = row.get('date')
-                    service_id = row.get('service_id')
-                    exception_type = row.get('exception_type')
-                    if date_str and service_id and exception_type == "1":
-                        date = datetime.strptime(date_str, "%Y%m%d").date()
-                        service_days.setdefault(service_id, set()).add(date)
+            df = self._read_gtfs_csv("calendar_dates.txt", ('service_id', 'date', 'exception_type'))
+            df = df[(df['date'] != '') & (df['service_id'] != '') & (df['exception_type'] == "1")]
+            dates = pd.to_datetime(df['date'], format="%Y%m%d").dt.date.tolist()
+            for service_id, day in zip(df['service_id'].tolist(), dates):
+                service_days.setdefault(service_id, set()).add(day)
         except Exception as e:
             logger.error(f"Error loading calendar_dates: {e}")
         return service_days
     
-    @staticmethod
-    def haversine(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
-        """Calculate distance between two points in meters"""
-        R = 6371e3  # Earth radius in meters
-        phi1, phi2 = radians(lat1), radians(lat2)
-        dphi = radians(lat2 - lat1)
-        dlambda = radians(lon2 - lon1)
-        a = sin(dphi/2)**2 + cos(phi1)*cos(phi2)*sin(dlambda/2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1 - a))
-        return R * c
-    
-    def _parse_gtfs_time(self, time_str: str, trip_id: str, now: datetime) -> Optional[datetime]:
-        """Parse GTFS time string (can have hours > 23) to datetime"""
+    def _parse_gtfs_time(self, arrival_sec: int, trip_id: str, now: datetime) -> Optional[datetime]:
+        """Turn a GTFS time in seconds after midnight (can be past 24h) into a datetime"""
         try:
-            if not time_str:
+            if arrival_sec < 0:
                 return None
-            h, m, s = map(int, time_str.split(":"))
             
-            # Get service day for this trip
-            service_id = self.trip_services.get(trip_id)
+            # The candidate only depends on the day, so parse it once per service day
             today = now.date()
-            
-            if service_id and service_id in self.service_days and today in self.service_days[service_id]:
-                base = datetime.combine(today, dtime.min).replace(tzinfo=TZ)
-            else:
-                base = now.replace(hour=0, minute=0, second=0, microsecond=0)
-            
-            extra_days, hours_mod = divmod(h, 24)
-            candidate_dt = base + timedelta(days=extra_days, hours=hours_mod, minutes=m, seconds=s)
+            if today != self._sched_cache_day:
+                self._sched_cache.clear()
+                self._sched_cache_day = today
+            key = (trip_id, arrival_sec)
+            candidate_dt = self._sched_cache.get(key)
+            if candidate_dt is None:
+                # Get service day for this trip
+                service_id = self.trip_services.get(trip_id)
+                
+                if service_id and service_id in self.service_days and today in self.service_days[service_id]:
+                    base = datetime.combine(today, dtime.min).replace(tzinfo=TZ)
+                else:
+                    base = now.replace(hour=0, minute=0, second=0, microsecond=0)
+                
+                candidate_dt = base + timedelta(seconds=arrival_sec)
+                self._sched_cache[key] = candidate_dt
             
             # Find closest candidate (yesterday, today, or tomorrow)
             candidates = [
@@ -169,163 +326,259 @@ class ArrivalLogger:
             ]
             return min(candidates, key=lambda dt: abs((dt - now).total_seconds()))
         except Exception as e:
-            logger.error(f"Error parsing GTFS time {time_str}: {e}")
+            logger.error(f"Error parsing GTFS time {arrival_sec}: {e}")
             return None
     
     def get_latest_arrival(self, trip_id: str) -> Optional[dict]:
         """Get latest arrival info for a trip_id (with cache TTL check)"""
-        with self.data_lock:
-            arrival = self.vehicle_latest_arrival.get(trip_id)
+        arrival = self.vehicle_latest_arrival.get(trip_id)
+        
+        if not arrival:
+            return None
+        
+        # Expired entries read as missing; the poll thread evicts them
+        last_seen = arrival.get('last_seen')
+        if last_seen:
+            now = datetime.now(tz=TZ)
+            age_seconds = (now - last_seen).total_seconds()
             
-            if not arrival:
+            if age_seconds > CACHE_TTL_SECONDS:
+                logger.debug(f"Cache expired for trip {trip_id} (age: {age_seconds:.1f}s)")
                 return None
-            
-            # Check if cache has expired
-            last_seen = arrival.get('last_seen')
-            if last_seen:
-                now = datetime.now(tz=TZ)
-                age_seconds = (now - last_seen).total_seconds()
-                
-                if age_seconds > CACHE_TTL_SECONDS:
-                    # Cache expired, remove it
-                    logger.debug(f"Cache expired for trip {trip_id} (age: {age_seconds:.1f}s)")
-                    del self.vehicle_latest_arrival[trip_id]
-                    # Also clean up arrivals set
-                    if trip_id in self.vehicle_arrivals:
-                        del self.vehicle_arrivals[trip_id]
-                    return None
-            
-            # Return a copy without the internal last_seen field
-            return {k: v for k, v in arrival.items() if k != 'last_seen'}
+        
+        # Return a copy without the internal last_seen field
+        return {k: v for k, v in arrival.items() if k != 'last_seen'}
     
-    def _log_arrival_to_csv(self, now: datetime, trip_id: str, route_id: str, 
+    def _log_arrival_to_csv(self, ts_str: str, dow_str: str, hour: int, trip_id: str, route_id: str, 
                             stop_id: str, stop_name: str, scheduled_dt: Optional[datetime], 
                             delay_sec: Optional[int]):
-        """Log arrival to CSV file"""
+        """Log arrival to CSV file; the poll's timestamp strings are formatted by the caller"""
         try:
-            with open(LOG_FILE, 'a', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                writer.writerow([
-                    now.strftime("%Y-%m-%d %H:%M:%S %Z"),
-                    trip_id,  # Using trip_id as vehicle_id
-                    trip_id,
-                    route_id or '',
-                    stop_id,
-                    stop_name,
-                    scheduled_dt.strftime("%Y-%m-%d %H:%M:%S %Z") if scheduled_dt else '',
-                    now.strftime("%Y-%m-%d %H:%M:%S %Z"),
-                    delay_sec if delay_sec is not None else '',
-                    now.strftime("%A"),
-                    now.hour
-                ])
+            self._csv_writer.writerow([
+                ts_str,
+                trip_id,  # Using trip_id as vehicle_id
+                trip_id,
+                route_id or '',
+                stop_id,
+                stop_name,
+                scheduled_dt.strftime("%Y-%m-%d %H:%M:%S %Z") if scheduled_dt else '',
+                ts_str,
+                delay_sec if delay_sec is not None else '',
+                dow_str,
+                hour
+            ])
+            self._csv_unflushed += 1
+            if self._csv_unflushed >= CSV_FLUSH_EVERY:
+                self._flush_csv()
         except Exception as e:
             logger.error(f"Error logging arrival to CSV: {e}")
+
+    def _flush_csv(self):
+        if self._csv_unflushed:
+            self._csv_fh.flush()
+            self._csv_unflushed = 0
+
+    def close(self):
+        """Flush and close the arrival log; called on shutdown"""
+        try:
+            self._flush_csv()
+            self._csv_fh.close()
+            self._http.close()
+        except Exception as e:
+            logger.error(f"Error closing CSV log: {e}")
     
+    def _remember_feed_validators(self, response):
+        validators = {}
+        etag = response.headers.get('ETag')
+        if etag:
+            validators['If-None-Match'] = etag
+        last_modified = response.headers.get('Last-Modified')
+        if last_modified:
+            validators['If-Modified-Since'] = last_modified
+        self._feed_validators = validators
+
+    def _touch_last_seen(self, latest_arrivals: Dict[str, dict], trip_ids: Set[str], now: datetime):
+        """Refresh last_seen in the private copy; the published entries are left untouched"""
+        now_ts = now.timestamp()
+        for trip_id in trip_ids:
+            arrival = latest_arrivals.get(trip_id)
+            if arrival is not None:
+                latest_arrivals[trip_id] = {**arrival, 'last_seen': now}
+                heapq.heappush(self._ttl_heap, (now_ts, trip_id))
+
+    def _publish(self, arrivals: Dict[str, int], latest_arrivals: Dict[str, dict]):
+        self.vehicle_arrivals = arrivals
+        self.vehicle_latest_arrival = latest_arrivals
+
+    def _evict_expired(self, arrivals: Dict[str, int], latest_arrivals: Dict[str, dict], now: datetime):
+        """Drop trips not seen for CACHE_TTL_SECONDS, oldest first"""
+        cutoff = now.timestamp() - CACHE_TTL_SECONDS
+        heap = self._ttl_heap
+        while heap and heap[0][0] < cutoff:
+            ts, trip_id = heapq.heappop(heap)
+            arrival = latest_arrivals.get(trip_id)
+            # Only the entry of the trip's current last_seen evicts it
+            if arrival is not None and arrival['last_seen'].timestamp() == ts:
+                del latest_arrivals[trip_id]
+                arrivals.pop(trip_id, None)
+
+    async def _fetch_feed(self, delay: float):
+        """Wait delay seconds, then fetch the feed in a worker thread"""
+        if delay:
+            await asyncio.sleep(delay)
+        # Validators are read when the request is sent. If processing the
+        # previous feed overran the delay, they may be one feed behind; the
+        # server then answers 200 instead of 304, which only costs a re-parse
+        return await asyncio.to_thread(
+            self._http.get,
+            GTFS_RT_URL, timeout=REQUEST_TIMEOUT, headers=self._feed_validators
+        )
+
+    def _process_response(self, response):
+        """Parse one feed response, log the new arrivals and publish the caches"""
+        try:
+            if response.status_code == 304:
+                # Same feed as last time: nothing new to match, the vehicles
+                # in it are just still there
+                touch_vehicle_positions()
+                now = datetime.now(tz=TZ)
+                arrivals = dict(self.vehicle_arrivals)
+                latest_arrivals = dict(self.vehicle_latest_arrival)
+                self._touch_last_seen(latest_arrivals, self._last_feed_trip_ids, now)
+                self._evict_expired(arrivals, latest_arrivals, now)
+                self._publish(arrivals, latest_arrivals)
+                return
+
+            if response.status_code != 200:
+                logger.error(f"GTFS-RT endpoint returned status {response.status_code}")
+                return
+
+            # Parse protobuf
+            feed = gtfs_realtime_pb2.FeedMessage()
+            feed.ParseFromString(response.content)
+            self._remember_feed_validators(response)
+            # Requests read vehicle positions from this same poll
+            publish_vehicle_positions(positions_from_feed(feed))
+
+            now = datetime.now(tz=TZ)
+            logged_count = 0
+
+            # now is fixed for the whole feed, so format it once
+            ts_str = now.strftime("%Y-%m-%d %H:%M:%S %Z")
+            dow_str = now.strftime("%A")
+            hour = now.hour
+
+            # Private copies, published in one rebind at the end of the poll
+            arrivals = dict(self.vehicle_arrivals)
+            latest_arrivals = dict(self.vehicle_latest_arrival)
+
+            # Collect the vehicles that are on a known trip
+            trip_ids, route_ids, vehicle_trips, vehicle_lats, vehicle_lons = extract_vehicles(
+                feed, self.trip_index
+            )
+            # Update last_seen timestamp for vehicles present in this feed
+            trip_ids_in_feed = set(trip_ids)
+
+            # Match every vehicle against its trip's stops in one batch;
+            # hits come back in feed order, then trip stop order
+            hit_vehicles, hit_flat = match_arrivals(
+                np.asarray(vehicle_lats, dtype=np.float64),
+                np.asarray(vehicle_lons, dtype=np.float64),
+                np.asarray(vehicle_trips, dtype=np.int64),
+                self.trip_stop_ptr, self.trip_stop_rows,
+                self.stop_lat_arr, self.stop_lon_arr, self._sorted_lat,
+            )
+            hits = zip(
+                hit_vehicles.tolist(),
+                self.trip_stop_rows[hit_flat].tolist(),
+                self.trip_stop_arrival_sec[hit_flat].tolist(),
+                self.trip_stop_seq[hit_flat].tolist(),
+                self.trip_stop_bit[hit_flat].tolist(),
+            )
+            for v, row, arrival_sec, seq, bit in hits:
+                trip_id = trip_ids[v]
+                route_id = route_ids[v]
+                stop_bit = 1 << bit
+                stop_id = self.stop_ids[row]
+                stop = self.stops[stop_id]
+
+                # Check if already logged this arrival
+                if arrivals.get(trip_id, 0) & stop_bit:
+                    continue
+
+                # Calculate delay
+                stop_sequence = str(seq) if seq >= 0 else ''
+                scheduled_dt = self._parse_gtfs_time(arrival_sec, trip_id, now)
+
+                delay_sec = None
+                if scheduled_dt:
+                    delay_sec = int((now - scheduled_dt).total_seconds())
+
+                # Log to CSV
+                self._log_arrival_to_csv(ts_str, dow_str, hour, trip_id, route_id, stop_id, 
+                                        stop['name'], scheduled_dt, delay_sec)
+
+                # Store arrival info
+                arrivals[trip_id] = arrivals.get(trip_id, 0) | stop_bit
+                latest_arrivals[trip_id] = {
+                    'stop_id': stop_id,
+                    'stop_name': stop['name'],
+                    'stop_sequence': stop_sequence,
+                    'timestamp': ts_str,
+                    'delay_seconds': delay_sec,
+                    'route_id': route_id,
+                    'trip_id': trip_id,
+                    'last_seen': now  # Track when we last saw this vehicle
+                }
+
+                logged_count += 1
+
+            # Update last_seen for vehicles that are still in the feed but didn't trigger new arrivals
+            self._touch_last_seen(latest_arrivals, trip_ids_in_feed, now)
+            self._last_feed_trip_ids = trip_ids_in_feed
+            self._evict_expired(arrivals, latest_arrivals, now)
+            self._publish(arrivals, latest_arrivals)
+
+            self._flush_csv()
+            logger.info(f"Logged {logged_count} arrivals (feed entities: {len(feed.entity)})")
+            
+        except DecodeError:
+            logger.error("DecodeError: Received non-protobuf or truncated GTFS-RT response")
+        except Exception as e:
+            logger.error(f"Error in polling loop: {e}")
+
     async def poll_vehicles(self):
-        """Main polling loop - runs continuously"""
+        """
+        Main polling loop - runs continuously.
+        The next fetch is started before the current feed is processed, so the
+        request and the parse/match work (both in worker threads) overlap and
+        the event loop never runs either.
+        """
         logger.info("Starting GTFS-RT polling loop")
         
-        while True:
-            try:
-                # Fetch vehicle positions
-                response = requests.get(GTFS_RT_URL, timeout=REQUEST_TIMEOUT)
-                
-                if response.status_code != 200:
-                    logger.error(f"GTFS-RT endpoint returned status {response.status_code}")
-                    await asyncio.sleep(POLL_INTERVAL)
-                    continue
-                
-                # Parse protobuf
-                feed = gtfs_realtime_pb2.FeedMessage()
-                feed.ParseFromString(response.content)
-                
-                now = datetime.now(tz=TZ)
-                logged_count = 0
-                
-                # Update last_seen timestamp for vehicles present in this feed
-                trip_ids_in_feed = set()
-                
-                # Process each vehicle
-                for entity in feed.entity:
-                    if not (entity.HasField('vehicle') and entity.vehicle.HasField('position')):
-                        continue
-                    
-                    vehicle = entity.vehicle
-                    
-                    # Get trip_id (we'll use this as vehicle_id for consistency)
-                    trip_id = vehicle.trip.trip_id if vehicle.trip.HasField('trip_id') else None
-                    if not trip_id or trip_id not in self.trip_stops:
-                        continue
-                    
-                    # Track that this trip_id is in the current feed
-                    trip_ids_in_feed.add(trip_id)
-                    
-                    route_id = vehicle.trip.route_id if vehicle.trip.HasField('route_id') else None
-                    lat = vehicle.position.latitude
-                    lon = vehicle.position.longitude
-                    
-                    # Check each stop in this trip
-                    for stop_info in self.trip_stops.get(trip_id, []):
-                        stop_id = stop_info.get('stop_id')
-                        if not stop_id or stop_id not in self.stops:
-                            continue
-                        
-                        stop = self.stops[stop_id]
-                        distance = self.haversine(lat, lon, stop['lat'], stop['lon'])
-                        
-                        if distance >= DISTANCE_THRESHOLD_M:
-                            continue
-                        
-                        # Check if already logged this arrival
-                        with self.data_lock:
-                            if trip_id not in self.vehicle_arrivals:
-                                self.vehicle_arrivals[trip_id] = set()
-                            if stop_id in self.vehicle_arrivals[trip_id]:
-                                continue
-                        
-                        # Calculate delay
-                        scheduled_time_str = stop_info.get('arrival_time')
-                        stop_sequence = stop_info.get('stop_sequence')
-                        scheduled_dt = self._parse_gtfs_time(scheduled_time_str, trip_id, now)
-                        
-                        delay_sec = None
-                        if scheduled_dt:
-                            delay_sec = int((now - scheduled_dt).total_seconds())
-                        
-                        # Log to CSV
-                        self._log_arrival_to_csv(now, trip_id, route_id, stop_id, 
-                                                stop['name'], scheduled_dt, delay_sec)
-                        
-                        # Store arrival info
-                        with self.data_lock:
-                            self.vehicle_arrivals[trip_id].add(stop_id)
-                            self.vehicle_latest_arrival[trip_id] = {
-                                'stop_id': stop_id,
-                                'stop_name': stop['name'],
-                                'stop_sequence': stop_sequence,
-                                'timestamp': now.strftime("%Y-%m-%d %H:%M:%S %Z"),
-                                'delay_seconds': delay_sec,
-                                'route_id': route_id,
-                                'trip_id': trip_id,
-                                'last_seen': now  # Track when we last saw this vehicle
-                            }
-                        
-                        logged_count += 1
-                
-                # Update last_seen for vehicles that are still in the feed but didn't trigger new arrivals
-                with self.data_lock:
-                    for trip_id in trip_ids_in_feed:
-                        if trip_id in self.vehicle_latest_arrival:
-                            self.vehicle_latest_arrival[trip_id]['last_seen'] = now
-                
-                logger.info(f"Logged {logged_count} arrivals (feed entities: {len(feed.entity)})")
+        fetch = asyncio.create_task(self._fetch_feed(0))
+        processing = None
+        try:
+            while True:
+                try:
+                    response = await fetch
+                except Exception as e:
+                    logger.error(f"Error fetching GTFS-RT feed: {e}")
+                    response = None
                 
-            except DecodeError:
-                logger.error("DecodeError: Received non-protobuf or truncated GTFS-RT response")
-            except Exception as e:
-                logger.error(f"Error in polling loop: {e}")
-            
-            await asyncio.sleep(POLL_INTERVAL)
+                fetch = asyncio.create_task(self._fetch_feed(POLL_INTERVAL))
+                if response is not None:
+                    # Shielded: cancelling the loop must not abandon a worker
+                    # thread that is still writing the log
+                    processing = asyncio.ensure_future(
+                        asyncio.to_thread(self._process_response, response)
+                    )
+                    await asyncio.shield(processing)
+        finally:
+            fetch.cancel()
+            # A thread can't be interrupted, so wait for it before close() runs
+            if processing is not None and not processing.done():
+                await asyncio.wait([processing])
 
 
 # Global instance
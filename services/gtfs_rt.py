@@ -0,0 +1,21 @@
+# Single import point for the GTFS-RT protobuf bindings
+import logging
+import os
+
+# Ask for the upb (C) protobuf backend before anything imports protobuf, so
+# ParseFromString runs in C. It is the default for protobuf>=4.21; this keeps
+# a stray environment setting from silently falling back to pure Python.
+os.environ.setdefault("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION", "upb")
+
+from google.transit import gtfs_realtime_pb2
+from google.protobuf.message import DecodeError
+from google.protobuf.internal import api_implementation
+
+# The setdefault above is ignored if protobuf was imported first or an old
+# wheel has no compiled backend; feed parsing is then 10x+ slower, so say so
+if api_implementation.Type() == "python":
+    logging.getLogger(__name__).warning(
+        "protobuf is using the pure-Python backend; GTFS-RT parsing will be slow"
+    )
+
+__all__ = ["gtfs_realtime_pb2", "DecodeError"]
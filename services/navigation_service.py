@@ -1,36 +1,42 @@
 # services/navigation_service.py
+from dataclasses import dataclass
 from datetime import datetime
-from services.raptor_service import RaptorService
+from services.raptor_service import RaptorService, haversine
 from services.timetables import Timetables
-from services.routes_service import RoutesService
-from math import radians, sin, cos, sqrt, atan2
 
 MAX_WALKING_DISTANCE_M = 500
 
+
+# Response rows; orjson serializes these directly, fields in declaration order.
+# Walk legs stay dicts because their "from"/"to" keys are Python keywords.
+@dataclass(slots=True)
+class TransitLeg:
+    type: str
+    route_id: str | None
+    trip_id: str
+    from_stop_id: str
+    to_stop_id: str | None
+    from_stop_name: str
+    to_stop_name: str
+    departure_time: str
+    arrival_time: str | None
+
+
+@dataclass(slots=True)
+class RouteOption:
+    total_time_seconds: int
+    total_time_minutes: float
+    legs: list
+
 class NavigationService:
-    def __init__(self, db):
+    def __init__(self, timetable: Timetables, raptor: RaptorService, reallife_ids: dict[str, str]):
         """
-        db: SQLAlchemy session
+        timetable / raptor: the instances loaded at startup
+        reallife_ids: route_id -> reallife id (RoutesService.get_reallife_id_map)
         """
-        self.db = db
-        
-        # Load timetable into memory
-        self.timetable = Timetables(db)
-        self.timetable.load()
-
-        # Initialize RAPTOR service
-        self.raptor = RaptorService(self.timetable)
-
-    @staticmethod
-    def haversine(lat1, lon1, lat2, lon2):
-        """Distance in meters between two points"""
-        R = 6371e3
-        phi1, phi2 = radians(lat1), radians(lat2)
-        dphi = radians(lat2 - lat1)
-        dlambda = radians(lon2 - lon1)
-        a = sin(dphi/2)**2 + cos(phi1)*cos(phi2)*sin(dlambda/2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1 - a))
-        return R * c
+        self.timetable = timetable
+        self.raptor = raptor
+        self.reallife_ids = reallife_ids
 
     @staticmethod
     def parse_time_to_seconds(time_str):
@@ -80,8 +86,7 @@ class NavigationService:
 
         # Format for frontend
         formatted_routes = []
-        
-        routes_service = RoutesService(self.db)
+        reallife_ids = self.reallife_ids
         
         for r in results[:5]:  # top 5 routes
             formatted_legs = []
@@ -97,25 +102,25 @@ class NavigationService:
                     })
                 # Transit leg
                 elif leg["type"] == "transit":
-                    formatted_legs.append({
-                        "type": "transit",
-                        "route_id": routes_service.get_reallife_id(leg["route_id"]),
-                        "trip_id": leg["trip_id"],
-                        "from_stop_id": leg["from_stop_id"],
-                        "to_stop_id": leg.get("to_stop_id"),
-                        "from_stop_name": leg["from_stop_name"],
-                        "to_stop_name": leg["to_stop_name"],
-                        "departure_time": leg["departure_time"],
-                        "arrival_time": leg.get("arrival_time")
-                    })
+                    formatted_legs.append(TransitLeg(
+                        "transit",
+                        reallife_ids.get(leg["route_id"]),
+                        leg["trip_id"],
+                        leg["from_stop_id"],
+                        leg.get("to_stop_id"),
+                        leg["from_stop_name"],
+                        leg["to_stop_name"],
+                        leg["departure_time"],
+                        leg.get("arrival_time"),
+                    ))
 
-            formatted_routes.append({
-                "total_time_seconds": r["total_time"],
-                "total_time_minutes": round(r["total_time"]/60, 1),
-                "legs": formatted_legs
-            })
+            formatted_routes.append(RouteOption(
+                r["total_time"],
+                round(r["total_time"]/60, 1),
+                formatted_legs,
+            ))
 
-        straight_distance = self.haversine(origin_lat, origin_lon, dest_lat, dest_lon)
+        straight_distance = haversine(origin_lat, origin_lon, dest_lat, dest_lon)
 
         response = {
             "origin": {"lat": origin_lat, "lon": origin_lon},
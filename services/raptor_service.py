@@ -1,7 +1,13 @@
+from bisect import bisect_left
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from math import radians, sin, cos, sqrt, atan2
+import os
 import json
 from datetime import datetime
+import numpy as np
+import orjson
 
 MAX_WALKING_DISTANCE_M = 500  # Max distance to walk between transfers
 WALKING_SPEED_MS = 1.4
@@ -9,6 +15,94 @@ MAX_RESULTS = 5
 MAX_TRANSFERS = 3
 SEARCH_WINDOW_HOURS = 4
 TRANSFER_TIME = 180  # 3 minutes buffer
+INF = float("inf")
+EARTH_RADIUS_M = 6371e3
+NEARBY_LIMIT = 15  # stops returned by find_nearby_stops
+TRANSFER_BLOCK_ROWS = 512  # rows per haversine block when building transfers
+NEARBY_CACHE_SIZE = 1024  # recent find_nearby_stops queries kept per service
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Distance in meters between two points (scalar math, no numpy)"""
+    if lat1 == lat2 and lon1 == lon2:
+        return 0.0
+    phi1, phi2 = radians(lat1), radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = radians(lon2 - lon1)
+    a = sin(dphi/2)**2 + cos(phi1)*cos(phi2)*sin(dlambda/2)**2
+    return 2 * EARTH_RADIUS_M * atan2(sqrt(a), sqrt(1 - a))
+
+
+# "HH:MM:SS" -> seconds; a feed only has a few thousand distinct times
+_TIME_CACHE: dict[str, int] = {}
+
+
+def time_to_seconds(time_str):
+    seconds = _TIME_CACHE.get(time_str)
+    if seconds is None:
+        h, m, s = map(int, time_str.split(":"))
+        seconds = _TIME_CACHE[time_str] = h*3600 + m*60 + s
+    return seconds
+
+
+def board_route(trips, departures, tau_prev, wrap_before):
+    """
+    Earliest trip of a route that can be boarded at a marked stop.
+    trips: [(trip_id, stop_times, stop_idxs, dep_secs, arr_secs)] sharing one
+    stop pattern, departures: per pattern position, (departure seconds sorted
+    ascending, matching positions in trips), tau_prev: previous round's arrival
+    per dense stop id (INF = not marked), wrap_before: departures earlier than
+    this are on the next day.
+    Each marked position is two binary searches, one for today's departures and
+    one for those wrapped to the next day. Ties go to the earlier trip, then
+    the earlier position.
+    Returns (trip, boarding position, boarding time), trip None if none fits.
+    """
+    best = None  # (boarding time, trip position, pattern position)
+    for pos, i in enumerate(trips[0][2]):
+        earliest_arrival = tau_prev[i]
+        if earliest_arrival == INF: continue
+
+        ready = earliest_arrival + TRANSFER_TIME
+        deps, trip_order = departures[pos]
+        wrapped = bisect_left(deps, wrap_before)
+
+        j = bisect_left(deps, max(ready, wrap_before), wrapped)
+        if j < len(deps):
+            candidate = (deps[j], trip_order[j], pos)
+            if best is None or candidate < best:
+                best = candidate
+
+        j = bisect_left(deps, ready - 86400, 0, wrapped)
+        if j < wrapped:
+            candidate = (deps[j] + 86400, trip_order[j], pos)
+            if best is None or candidate < best:
+                best = candidate
+
+    if best is None:
+        return None, -1, INF
+    boarding_time, trip_pos, pos = best
+    return trips[trip_pos], pos, boarding_time
+
+
+def ride_trip(stop_idxs, arr_secs, boarding_idx, tau_k, wrap_before, window_end):
+    """
+    Relax this round's arrivals (tau_k, updated in place) along a boarded trip.
+    Returns [(position, arrival time)] of the stops that improved.
+    """
+    improved = []
+    for idx in range(boarding_idx + 1, len(stop_idxs)):
+        arr_time = arr_secs[idx]
+        arr_time += 86400 * (arr_time < wrap_before)
+
+        if arr_time > window_end: continue
+
+        i = stop_idxs[idx]
+        if arr_time < tau_k[i]:
+            tau_k[i] = arr_time
+            improved.append((idx, arr_time))
+    return improved
+
 
 class RaptorService:
     def __init__(self, timetable):
@@ -16,90 +110,272 @@ class RaptorService:
         timetable: instance of Timetables loaded in memory
         """
         self.timetable = timetable
-        # Precompute transfers between stops once to save time per request
-        self.transfers = self._build_transfer_graph()
-
-    @staticmethod
-    def haversine(lat1, lon1, lat2, lon2):
-        """Distance in meters between two points"""
-        R = 6371e3
-        phi1, phi2 = radians(lat1), radians(lat2)
-        dphi = radians(lat2 - lat1)
-        dlambda = radians(lon2 - lon1)
-        a = sin(dphi/2)**2 + cos(phi1)*cos(phi2)*sin(dlambda/2)**2
-        c = 2 * atan2(sqrt(a), sqrt(1 - a))
-        return R * c
+        # Stop coordinates as parallel arrays (radians) for vectorized lookups
+        self._build_stop_coordinates()
+        # Dense integer ids so per-query state can live in flat arrays
+        self._build_stop_index()
+        # Stops as they appear in walk legs, serialized once
+        self._stop_fragments = self._build_stop_fragments()
+        # Precompute transfers between stops once to save time per request:
+        # sets _transfer_nbr/_transfer_sec, per dense stop id, parallel
+        # arrays of neighbor ids and walk seconds
+        self._build_transfer_graph()
+        # Trips' stop times sorted and converted to seconds once
+        self._trip_cache = self._build_trip_cache()
+        # Route patterns are static too, so they are grouped once, not per query
+        self._routes, self._routes_by_stop = self._build_route_patterns()
+        # Clients repeat the same endpoints across requests, so recent
+        # nearby-stop lookups are memoized per instance
+        self._nearby_cached = lru_cache(maxsize=NEARBY_CACHE_SIZE)(self._find_nearby_stops)
+
+    def _build_stop_coordinates(self):
+        stops = self.timetable.stops
+        self._stop_ids = list(stops.keys())
+        # (N, 2) lat/lon in degrees, parsed in a single pass over the stops
+        self._coords = np.array(
+            [(float(s["lat"]), float(s["lon"])) for s in stops.values()], dtype=np.float64
+        ).reshape(len(stops), 2)
+        # Radians per axis as separate contiguous arrays for the ufunc kernels
+        self._lat_rad = np.radians(self._coords[:, 0])
+        self._lon_rad = np.radians(self._coords[:, 1])
+        # Stops ordered by latitude: a latitude band becomes two binary searches
+        self._lat_order = np.argsort(self._lat_rad, kind="stable")
+        self._lat_sorted = self._lat_rad[self._lat_order]
+
+    def _build_stop_index(self):
+        """
+        stop_id <-> dense index. Timetable stops come first, in the order of the
+        coordinate arrays, followed by any stop only referenced by stop times.
+        """
+        self._idx_to_stop = list(self._stop_ids)
+        self._stop_idx = {stop_id: i for i, stop_id in enumerate(self._idx_to_stop)}
+        for stop_times in self.timetable.stop_times_by_trip.values():
+            for stop_id in stop_times.stop_ids:
+                if stop_id not in self._stop_idx:
+                    self._stop_idx[stop_id] = len(self._idx_to_stop)
+                    self._idx_to_stop.append(stop_id)
+
+    def _build_stop_fragments(self):
+        """
+        stop_id -> pre-serialized {"lat", "lon", "stop_id", "stop_name"}.
+        orjson splices Fragments in verbatim, so a stop shared by many legs
+        and responses is only ever encoded here.
+        """
+        return {
+            stop_id: orjson.Fragment(orjson.dumps({
+                "lat": float(stop["lat"]),
+                "lon": float(stop["lon"]),
+                "stop_id": stop_id,
+                "stop_name": stop["stop_name"],
+            }))
+            for stop_id, stop in self.timetable.stops.items()
+        }
 
     def _build_transfer_graph(self):
         """
-        Builds a graph of walking transfers between stops that are close to each other.
-        Returns: {stop_id: [(neighbor_id, walk_seconds), ...]}
+        Builds the walking transfers between stops that are close to each other
+        as _transfer_nbr/_transfer_sec: per dense stop id, neighbor ids in
+        ascending order and the matching walk seconds.
         """
-        transfers = defaultdict(list)
-        
-        # Get list of (stop_id, stop_data) tuples
-        stops = list(self.timetable.stops.items())
-        
-        print(f"Building transfer graph for {len(stops)} stops...")
-        count = 0
-        for i in range(len(stops)):
-            id1, s1 = stops[i]
-            for j in range(i + 1, len(stops)):
-                id2, s2 = stops[j]
-                
-                # Fast box check to skip distant stops
-                if abs(float(s1["lat"]) - float(s2["lat"])) > 0.01: continue
-                if abs(float(s1["lon"]) - float(s2["lon"])) > 0.01: continue
-
-                dist = self.haversine(
-                    float(s1["lat"]), float(s1["lon"]),
-                    float(s2["lat"]), float(s2["lon"])
+        n = len(self._stop_ids)
+        lat, lon = self._lat_rad, self._lon_rad
+        cos_lat = np.cos(lat)
+
+        print(f"Building transfer graph for {n} stops...")
+        # Sweep the latitude-sorted stops: a pair within MAX_WALKING_DISTANCE_M
+        # is within that many meters of latitude, so each block of rows only
+        # needs the columns up to its latitude band (binary search), and only
+        # those after it (upper triangle)
+        order = self._lat_order
+        lat_s, lon_s, cos_s = lat[order], lon[order], cos_lat[order]
+        band = MAX_WALKING_DISTANCE_M / EARTH_RADIUS_M + 1e-12
+
+        def block(start):
+            end = min(start + TRANSFER_BLOCK_ROWS, n)
+            stop = int(np.searchsorted(lat_s, lat_s[end - 1] + band, side="right"))
+            rows = slice(start, end)
+            cols = slice(start, stop)
+            a = (
+                np.sin((lat_s[None, cols] - lat_s[rows, None]) / 2) ** 2
+                + cos_s[rows, None] * cos_s[None, cols]
+                * np.sin((lon_s[None, cols] - lon_s[rows, None]) / 2) ** 2
+            )
+            dist = 2 * EARTH_RADIUS_M * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+            # Column c of row r is sorted stop start + c; keep pairs with c > r
+            upper = np.arange(stop - start)[None, :] > np.arange(end - start)[:, None]
+            i, j = np.nonzero((dist <= MAX_WALKING_DISTANCE_M) & upper)
+            return order[i + start], order[j + start], dist[i, j]
+
+        # Blocks are independent and numpy releases the GIL inside the
+        # kernels, so they run on a thread pool; map keeps them in order
+        empty = np.empty(0, dtype=np.int64)
+        pairs_i, pairs_j, pair_dist = [empty], [empty], [np.empty(0)]
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+            for i, j, dist in pool.map(block, range(0, n, TRANSFER_BLOCK_ROWS)):
+                pairs_i.append(i)
+                pairs_j.append(j)
+                pair_dist.append(dist)
+
+        pairs_i = np.concatenate(pairs_i)
+        pairs_j = np.concatenate(pairs_j)
+        walk_time = (np.concatenate(pair_dist) / WALKING_SPEED_MS).astype(np.int64)
+
+        # Both directions, grouped by stop with neighbors in ascending order
+        src = np.concatenate([pairs_i, pairs_j])
+        dst = np.concatenate([pairs_j, pairs_i])
+        walk = np.concatenate([walk_time, walk_time])
+        by_src = np.lexsort((dst, src))
+        src, dst, walk = src[by_src], dst[by_src], walk[by_src]
+
+        # CSR split by source stop; timetable stops are the first n dense
+        # ids, stops only seen in stop times have no coordinates or transfers
+        indptr = np.searchsorted(src, np.arange(1, n))
+        no_transfers = [np.empty(0, dtype=np.int32)] * (len(self._idx_to_stop) - n)
+        self._transfer_nbr = np.split(dst.astype(np.int32), indptr) + no_transfers
+        self._transfer_sec = np.split(walk.astype(np.int32), indptr) + no_transfers
+
+        print(f"Transfer graph built: {len(pairs_i)} connections found.")
+
+    def _build_trip_cache(self):
+        """
+        trip_id -> (TripStopTimes sorted by departure, stop pattern key (int32
+        bytes of the dense stop indexes), dense stop indexes, departure seconds,
+        arrival seconds). Times are wrapped past midnight relative to the trip's
+        first departure, so only the per-query wrap is left for run().
+        """
+        cache = {}
+        for trip_id, stop_times in self.timetable.stop_times_by_trip.items():
+            if not stop_times.stop_ids:
+                continue
+            departures = stop_times.departure_secs.tolist()
+            # Sort by time (stable); trips are almost always in order already
+            order = sorted(range(len(departures)), key=departures.__getitem__)
+            if order == list(range(len(order))):
+                sorted_stops = stop_times
+            else:
+                sorted_stops = stop_times._make(
+                    column[order] if isinstance(column, np.ndarray) else [column[i] for i in order]
+                    for column in stop_times
                 )
-                
-                if dist <= MAX_WALKING_DISTANCE_M:
-                    walk_time = int(dist / WALKING_SPEED_MS)
-                    # Add bidirectional transfer using the IDs we unpacked
-                    transfers[id1].append((id2, walk_time))
-                    transfers[id2].append((id1, walk_time))
-                    count += 1
-        
-        print(f"Transfer graph built: {count} connections found.")
-        return transfers
+            dep_secs = sorted_stops.departure_secs.tolist()
+
+            wrap_before = dep_secs[0] - 43200
+            dep_secs = [t + 86400 * (t < wrap_before) for t in dep_secs]
+            arr_secs = sorted_stops.arrival_secs.tolist()
+            arr_secs = [t + 86400 * (t < wrap_before) for t in arr_secs]
+
+            stop_idxs = [self._stop_idx[stop_id] for stop_id in sorted_stops.stop_ids]
+            cache[trip_id] = (
+                sorted_stops,
+                np.asarray(stop_idxs, dtype=np.int32).tobytes(),
+                stop_idxs,
+                dep_secs,
+                arr_secs,
+            )
+        return cache
+
+    def _build_route_patterns(self):
+        """
+        Groups trips into virtual routes (route_id, stop pattern id).
+        Returns ([(virtual_route_id, [(trip_id, stop_times, stop_idxs, dep_secs, arr_secs), ...],
+        departures by pattern position as board_route expects them)],
+        [indexes of the routes serving each dense stop id, ascending]).
+        """
+        trips_by_route = defaultdict(list)
+        # Small int per distinct stop pattern
+        pattern_ids: dict[bytes, int] = {}
+        for trip_id, (sorted_stops, stop_pattern, stop_idxs, dep_secs, arr_secs) in self._trip_cache.items():
+            route_id = self.timetable.trips[trip_id].route_id
+            
+            # Pattern signature
+            pattern_id = pattern_ids.setdefault(stop_pattern, len(pattern_ids))
+            virtual_route_id = (route_id, pattern_id)
+            trips_by_route[virtual_route_id].append((trip_id, sorted_stops, stop_idxs, dep_secs, arr_secs))
+
+        routes = []
+        for virtual_route_id, trips in trips_by_route.items():
+            # Per position: departures sorted (stable, so equal times keep trip order)
+            departures = []
+            for pos in range(len(trips[0][2])):
+                column = [trip[3][pos] for trip in trips]
+                trip_order = sorted(range(len(trips)), key=column.__getitem__)
+                departures.append(([column[t] for t in trip_order], trip_order))
+            routes.append((virtual_route_id, trips, departures))
+
+        routes_by_stop = [[] for _ in self._idx_to_stop]
+        for route_idx, (_, trips, _) in enumerate(routes):
+            # Stops of the route's first trip, as the scan in run() samples them
+            for i in dict.fromkeys(trips[0][2]):
+                routes_by_stop[i].append(route_idx)
+        return routes, routes_by_stop
 
     def find_nearby_stops(self, lat, lon, max_distance=MAX_WALKING_DISTANCE_M):
+        # Shallow copy so callers can't reorder the cached list
+        return list(self._nearby_cached(lat, lon, max_distance))
+
+    def _find_nearby_stops(self, lat, lon, max_distance):
+        lat0, lon0 = radians(lat), radians(lon)
+
+        # Latitude band prefilter: a degree of latitude is the same length
+        # everywhere, so nothing outside the band can be within max_distance.
+        # The band is a contiguous slice of the latitude-sorted stops.
+        band = max_distance / EARTH_RADIUS_M
+        lo = np.searchsorted(self._lat_sorted, lat0 - band, side="left")
+        hi = np.searchsorted(self._lat_sorted, lat0 + band, side="right")
+        if lo >= hi:
+            return []
+        # Back to timetable order so ties keep the same ranking
+        candidates = np.sort(self._lat_order[lo:hi])
+
+        # Haversine on the survivors only
+        cand_lat = self._lat_rad[candidates]
+        a = (
+            np.sin((cand_lat - lat0) / 2) ** 2
+            + cos(lat0) * np.cos(cand_lat) * np.sin((self._lon_rad[candidates] - lon0) / 2) ** 2
+        )
+        distances = 2 * EARTH_RADIUS_M * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+
+        within = distances <= max_distance
+        candidates, distances = candidates[within], distances[within]
+        if len(distances) > NEARBY_LIMIT:
+            # Only the closest NEARBY_LIMIT get sorted: partition out the
+            # cutoff distance and keep everything up to it (ties included)
+            cutoff = np.partition(distances, NEARBY_LIMIT - 1)[NEARBY_LIMIT - 1]
+            keep = distances <= cutoff
+            candidates, distances = candidates[keep], distances[keep]
+        # Stable, so equal distances keep the timetable's stop order
+        order = np.argsort(distances, kind="stable")[:NEARBY_LIMIT]
+
+        stops = self.timetable.stops
         nearby = []
-        for stop_id, stop in self.timetable.stops.items():
-            stop_lat = float(stop["lat"])
-            stop_lon = float(stop["lon"])
-            distance = self.haversine(lat, lon, stop_lat, stop_lon)
-            if distance <= max_distance:
-                walking_time = int(distance / WALKING_SPEED_MS)
-                nearby.append({
-                    "stop_id": stop_id,
-                    "stop": stop,
-                    "distance": distance,
-                    "walking_time": walking_time
-                })
-        nearby.sort(key=lambda x: x["distance"])
-        return nearby[:15]
-
-    @staticmethod
-    def time_to_seconds(time_str):
-        h, m, s = map(int, time_str.split(":"))
-        return h*3600 + m*60 + s
+        for i in order:
+            stop_id = self._stop_ids[candidates[i]]
+            distance = float(distances[i])
+            nearby.append({
+                "stop_id": stop_id,
+                "stop": stops[stop_id],
+                "distance": distance,
+                "walking_time": int(distance / WALKING_SPEED_MS)
+            })
+        return nearby
 
     @staticmethod
     def has_duplicate_route_transfer(legs):
-        transit_legs = [leg for leg in legs if leg["type"] == "transit"]
-        for i in range(len(transit_legs) - 1):
-            if transit_legs[i]["route_id"] == transit_legs[i+1]["route_id"]:
-                return True
+        """True if two consecutive transit legs ride the same route"""
+        prev_transit = None
+        for leg in legs:
+            if leg["type"] == "transit":
+                if prev_transit is not None and leg["route_id"] == prev_transit["route_id"]:
+                    return True
+                prev_transit = leg
         return False
 
     @staticmethod
     def _get_transit_signature(legs):
-        transit_legs = [leg for leg in legs if leg["type"] == "transit"]
-        return tuple((leg["route_id"], leg["from_stop_id"], leg["to_stop_id"]) for leg in transit_legs)
+        return tuple(
+            (leg["route_id"], leg["from_stop_id"], leg["to_stop_id"])
+            for leg in legs if leg["type"] == "transit"
+        )
 
     @staticmethod
     def _filter_duplicate_routes_different_walk(results):
@@ -126,53 +402,21 @@ class RaptorService:
         Merge consecutive walking legs into a single leg.
         Takes the 'from' of the first walk and 'to' of the last walk.
         """
-        if not legs:
-            return legs
-        
         merged = []
-        i = 0
-        
-        while i < len(legs):
-            leg = legs[i]
-            
-            # If this is a walk leg, look ahead for consecutive walks
-            if leg["type"] == "walk":
-                consecutive_walks = [leg]
-                j = i + 1
-                
-                # Collect all consecutive walk legs
-                while j < len(legs) and legs[j]["type"] == "walk":
-                    consecutive_walks.append(legs[j])
-                    j += 1
-                
-                # If we have 2+ consecutive walks, merge them
-                if len(consecutive_walks) >= 2:
-                    first_walk = consecutive_walks[0]
-                    last_walk = consecutive_walks[-1]
-                    
-                    # Calculate total distance and time
-                    total_distance = sum(w["distance_m"] for w in consecutive_walks)
-                    total_duration = sum(w["duration_seconds"] for w in consecutive_walks)
-                    
-                    # Create merged leg
-                    merged_leg = {
-                        "type": "walk",
-                        "from": first_walk["from"],
-                        "to": last_walk["to"],
-                        "distance_m": total_distance,
-                        "duration_seconds": total_duration
-                    }
-                    merged.append(merged_leg)
-                    i = j  # Skip all the walks we just merged
-                else:
-                    # Only one walk, add it as-is
-                    merged.append(leg)
-                    i += 1
+        # Whether merged[-1] is our own copy (safe to accumulate into)
+        last_is_copy = False
+        for leg in legs:
+            if leg["type"] == "walk" and merged and merged[-1]["type"] == "walk":
+                if not last_is_copy:
+                    merged[-1] = dict(merged[-1])
+                    last_is_copy = True
+                walk = merged[-1]
+                walk["to"] = leg["to"]
+                walk["distance_m"] += leg["distance_m"]
+                walk["duration_seconds"] += leg["duration_seconds"]
             else:
-                # Not a walk leg, add it as-is
                 merged.append(leg)
-                i += 1
-        
+                last_is_copy = False
         return merged
 
     def run(self, origin_lat, origin_lon, dest_lat, dest_lon, departure_time_seconds, debug=False):
@@ -180,7 +424,6 @@ class RaptorService:
         
         origin_stops = self.find_nearby_stops(origin_lat, origin_lon)
         dest_stops = self.find_nearby_stops(dest_lat, dest_lon)
-        dest_stop_ids = {s["stop_id"] for s in dest_stops}
 
         if debug:
             debug_logs.append(f"\n=== DEBUG: Origin stops found: {len(origin_stops)} ===")
@@ -188,15 +431,19 @@ class RaptorService:
         if not origin_stops or not dest_stops:
             return {"routes": [], "debug_logs": debug_logs} if debug else []
 
-        tau = defaultdict(lambda: [float("inf")] * (MAX_TRANSFERS + 2))
-        parent = defaultdict(lambda: [{} for _ in range(MAX_TRANSFERS + 2)])
+        # Earliest arrival per round and stop, and the leg that achieved it,
+        # indexed [round][dense stop id]
+        stop_idx = self._stop_idx
+        n_stops = len(self._idx_to_stop)
+        tau = np.full((MAX_TRANSFERS + 2, n_stops), np.inf)
+        parent = [[None] * n_stops for _ in range(MAX_TRANSFERS + 2)]
 
         # Initialize walking from Origin
         for o in origin_stops:
-            stop_id = o["stop_id"]
+            i = stop_idx[o["stop_id"]]
             arrival = departure_time_seconds + o["walking_time"]
-            tau[stop_id][0] = arrival
-            parent[stop_id][0] = {
+            tau[0, i] = arrival
+            parent[0][i] = {
                 "type": "walk",
                 "from_lat": origin_lat,
                 "from_lon": origin_lon,
@@ -204,172 +451,131 @@ class RaptorService:
                 "arrival": arrival
             }
 
-        # Pre-group trips (Sort by TIME + Pattern)
-        trips_by_route = defaultdict(list)
-        for trip_id, stop_times in self.timetable.stop_times_by_trip.items():
-            route_id = self.timetable.trips[trip_id].route_id
-            
-            # Sort by sequence/time
-            sorted_stops = sorted(stop_times, key=lambda st: self.time_to_seconds(st.departure_time))
-            
-            # Pattern signature
-            stop_pattern = tuple(st.stop_id for st in sorted_stops)
-            virtual_route_id = f"{route_id}_{hash(stop_pattern)}"
-            trips_by_route[virtual_route_id].append((trip_id, sorted_stops))
-
         # --- RAPTOR Main Loop ---
         for k in range(1, MAX_TRANSFERS + 2):
             
             # 1. Identify stops to process (Marked stops)
-            marked_stops = {stop_id for stop_id in tau if tau[stop_id][k-1] < float("inf")}
+            marked_stops = np.flatnonzero(tau[k-1] < np.inf).tolist()
             
             if not marked_stops:
                 break
             
+            # The round's rows as lists for the scalar loops below (a marked
+            # stop is one whose previous-round arrival is finite)
+            tau_prev = tau[k-1].tolist()
+            tau_k = tau[k].tolist()
+            parent_k = parent[k]
             stops_updated_by_transit = set()
 
             # --- PHASE 1: TRANSIT (Ride routes) ---
-            for route_id, trips in trips_by_route.items():
-                sample_stops = trips[0][1]
-                if not any(st.stop_id in marked_stops for st in sample_stops):
-                    continue
-                
-                best_trip = None
-                best_boarding_stop = None
-                best_boarding_time = float("inf")
-                best_boarding_idx = -1
+            # Only routes serving a marked stop, in the same order as the full list
+            routes_by_stop = self._routes_by_stop
+            routes_to_scan = sorted({
+                route_idx for i in marked_stops for route_idx in routes_by_stop[i]
+            })
+            wrap_before = departure_time_seconds - 43200
+            window_end = departure_time_seconds + (SEARCH_WINDOW_HOURS * 3600)
+            for route_idx in routes_to_scan:
+                route_id, trips, departures = self._routes[route_idx]
                 
-                for trip_id, stop_times in trips:
-                    first_stop_time = self.time_to_seconds(stop_times[0].departure_time)
-                    
-                    for idx, st in enumerate(stop_times):
-                        stop_id = st.stop_id
-                        if stop_id not in marked_stops: continue
-                        
-                        dep_time_raw = self.time_to_seconds(st.departure_time)
-                        if dep_time_raw < first_stop_time - 43200: dep_time = dep_time_raw + 86400
-                        else: dep_time = dep_time_raw
-                        if dep_time < departure_time_seconds - 43200: dep_time += 86400
-                        
-                        earliest_arrival = tau[stop_id][k-1]
-                        
-                        if dep_time < earliest_arrival: continue
-                        if earliest_arrival + TRANSFER_TIME > dep_time: continue
-                        if dep_time >= best_boarding_time: continue
-
-                        best_trip = (trip_id, stop_times, first_stop_time)
-                        best_boarding_stop = stop_id
-                        best_boarding_time = dep_time
-                        best_boarding_idx = idx
-                        break 
-
-                if best_trip:
-                    trip_id, stop_times, first_stop_time = best_trip
-                    for idx in range(best_boarding_idx + 1, len(stop_times)):
-                        st = stop_times[idx]
-                        stop_id = st.stop_id
-                        
-                        arr_time_raw = self.time_to_seconds(st.arrival_time)
-                        if arr_time_raw < first_stop_time - 43200: arr_time = arr_time_raw + 86400
-                        else: arr_time = arr_time_raw
-                        if arr_time < departure_time_seconds - 43200: arr_time += 86400
-                        
-                        if arr_time > departure_time_seconds + (SEARCH_WINDOW_HOURS * 3600): continue
-                        
-                        # Update arrival?
-                        if arr_time < tau[stop_id][k]:
-                            tau[stop_id][k] = arr_time
-                            stops_updated_by_transit.add(stop_id) # Mark for walking phase
-                            parent[stop_id][k] = {
-                                "type": "transit",
-                                "trip_id": trip_id,
-                                "boarding_stop": best_boarding_stop,
-                                "boarding_time": best_boarding_time,
-                                "boarding_st": stop_times[best_boarding_idx],
-                                "arrival_stop": stop_id,
-                                "arrival_time": arr_time,
-                                "arrival_st": st
-                            }
+                best_trip, best_boarding_idx, best_boarding_time = board_route(
+                    trips, departures, tau_prev, wrap_before
+                )
+                if best_trip is None:
+                    continue
+
+                trip_id, stop_times, stop_idxs, dep_secs, arr_secs = best_trip
+                improved = ride_trip(stop_idxs, arr_secs, best_boarding_idx, tau_k, wrap_before, window_end)
+                boarding_stop = stop_times.stop_ids[best_boarding_idx]
+                for idx, arr_time in improved:
+                    i = stop_idxs[idx]
+                    stops_updated_by_transit.add(i) # Mark for walking phase
+                    parent_k[i] = {
+                        "type": "transit",
+                        "trip_id": trip_id,
+                        "boarding_stop": boarding_stop,
+                        "boarding_time": best_boarding_time,
+                        "boarding_departure_time": stop_times.departure_times[best_boarding_idx],
+                        "arrival_stop": stop_times.stop_ids[idx],
+                        "arrival_time": arr_time,
+                        "arrival_stop_time": stop_times.arrival_times[idx],
+                    }
 
             # --- PHASE 2: TRANSFERS (Footpaths) ---
             # Walk from stops we just arrived at to nearby stops
-            for stop_id in stops_updated_by_transit:
-                arrival_time = tau[stop_id][k]
+            # One vectorized relaxation per stop over its neighbor arrays
+            tau[k] = tau_k
+            tau_row = tau[k]
+            idx_to_stop = self._idx_to_stop
+            for i in stops_updated_by_transit:
+                neighbors = self._transfer_nbr[i]
+                if not len(neighbors):
+                    continue
+                walk_secs = self._transfer_sec[i]
+                walk_arrivals = tau_row[i] + walk_secs
+                better = walk_arrivals < tau_row[neighbors]
+                if not better.any():
+                    continue
+                neighbors, walk_secs, walk_arrivals = neighbors[better], walk_secs[better], walk_arrivals[better]
+                tau_row[neighbors] = walk_arrivals
                 
-                if stop_id in self.transfers:
-                    for neighbor_id, walk_seconds in self.transfers[stop_id]:
-                        walk_arrival = arrival_time + walk_seconds
-                        
-                        if walk_arrival < tau[neighbor_id][k]:
-                            tau[neighbor_id][k] = walk_arrival
-                            parent[neighbor_id][k] = {
-                                "type": "transfer",
-                                "from_stop_id": stop_id,
-                                "to_stop_id": neighbor_id,
-                                "arrival": walk_arrival,
-                                "walk_time": walk_seconds,
-                                "previous_leg": parent[stop_id][k]
-                            }
+                for neighbor, walk_seconds, walk_arrival in zip(
+                    neighbors.tolist(), walk_secs.tolist(), walk_arrivals.tolist()
+                ):
+                    parent_k[neighbor] = {
+                        "type": "transfer",
+                        "from_stop_id": idx_to_stop[i],
+                        "to_stop_id": idx_to_stop[neighbor],
+                        "arrival": walk_arrival,
+                        "walk_time": walk_seconds,
+                        "previous_leg": parent_k[i]
+                    }
         
         # --- Reconstruct Routes ---
         candidate_routes = []
         search_window_end = departure_time_seconds + (SEARCH_WINDOW_HOURS * 3600)
         
-        for dest_id in dest_stop_ids:
+        # Nearest destination stops first, so remaining ties keep that order
+        for dest in dest_stops:
+            dest_id = dest["stop_id"]
+            arrivals = tau[:, stop_idx[dest_id]].tolist()
             for k in range(MAX_TRANSFERS + 2):
-                arrival_time = tau[dest_id][k]
-                if arrival_time < float("inf") and arrival_time <= search_window_end:
-                    candidate_routes.append((arrival_time, dest_id, k))
+                arrival_time = arrivals[k]
+                if arrival_time < INF and arrival_time <= search_window_end:
+                    candidate_routes.append((int(arrival_time), dest_id, k, dest["distance"]))
 
-        candidate_routes.sort(key=lambda x: x[0])
+        # Earliest arrival first; equal arrivals go to the shorter final walk
+        candidate_routes.sort(key=lambda c: (c[0], c[3]))
 
         results = []
         temp_results = []
 
-        for best_time, best_dest, best_round in candidate_routes:
+        for best_time, best_dest, best_round, _ in candidate_routes:
             legs = []
             current_stop = best_dest
             current_round = best_round
             
             while current_round >= 0:
-                if current_stop not in parent or not parent[current_stop][current_round]:
+                leg_info = parent[current_round][stop_idx[current_stop]]
+                if not leg_info:
                      break
 
-                leg_info = parent[current_stop][current_round]
                 
                 if leg_info["type"] == "walk":
-                    legs.insert(0, {
+                    legs.append({
                         "type": "walk",
                         "from": {"lat": leg_info["from_lat"], "lon": leg_info["from_lon"]},
-                        "to": {
-                            "lat": leg_info["to_stop"]["stop"]["lat"],
-                            "lon": leg_info["to_stop"]["stop"]["lon"],
-                            "stop_id": leg_info["to_stop"]["stop_id"],
-                            "stop_name": leg_info["to_stop"]["stop"]["stop_name"]
-                        },
+                        "to": self._stop_fragments[leg_info["to_stop"]["stop_id"]],
                         "distance_m": leg_info["to_stop"]["distance"],
                         "duration_seconds": leg_info["to_stop"]["walking_time"]
                     })
                     break
                 
                 elif leg_info["type"] == "transfer":
-                    from_stop = self.timetable.stops[leg_info["from_stop_id"]]
-                    to_stop = self.timetable.stops[leg_info["to_stop_id"]]
-                    
-                    legs.insert(0, {
+                    legs.append({
                         "type": "walk",
-                        "from": {
-                            "lat": float(from_stop["lat"]), 
-                            "lon": float(from_stop["lon"]),
-                            "stop_id": leg_info["from_stop_id"],
-                            "stop_name": from_stop["stop_name"]
-                        },
-                        "to": {
-                            "lat": float(to_stop["lat"]), 
-                            "lon": float(to_stop["lon"]),
-                            "stop_id": leg_info["to_stop_id"],
-                            "stop_name": to_stop["stop_name"]
-                        },
+                        "from": self._stop_fragments[leg_info["from_stop_id"]],
+                        "to": self._stop_fragments[leg_info["to_stop_id"]],
                         "distance_m": leg_info["walk_time"] * WALKING_SPEED_MS,
                         "duration_seconds": leg_info["walk_time"]
                     })
@@ -378,39 +584,37 @@ class RaptorService:
                     # Do NOT decrement current_round
 
                 elif leg_info["type"] == "transit":
-                    boarding_st = leg_info["boarding_st"]
-                    arrival_st = leg_info["arrival_st"]
+                    boarding_stop = leg_info["boarding_stop"]
+                    arrival_stop = leg_info["arrival_stop"]
                     route_id = self.timetable.trips[leg_info["trip_id"]].route_id
 
-                    from_stop_name = self.timetable.stops[boarding_st.stop_id]["stop_name"]
-                    to_stop_name = self.timetable.stops[arrival_st.stop_id]["stop_name"]
+                    from_stop_name = self.timetable.stops[boarding_stop]["stop_name"]
+                    to_stop_name = self.timetable.stops[arrival_stop]["stop_name"]
                     
-                    legs.insert(0, {
+                    legs.append({
                         "type": "transit",
                         "route_id": route_id,
                         "trip_id": leg_info["trip_id"],
-                        "from_stop_id": boarding_st.stop_id,
-                        "to_stop_id": arrival_st.stop_id,
+                        "from_stop_id": boarding_stop,
+                        "to_stop_id": arrival_stop,
                         "from_stop_name": from_stop_name,
                         "to_stop_name": to_stop_name,
-                        "departure_time": boarding_st.departure_time,
-                        "arrival_time": arrival_st.arrival_time
+                        "departure_time": leg_info["boarding_departure_time"],
+                        "arrival_time": leg_info["arrival_stop_time"]
                     })
 
                     current_stop = leg_info["boarding_stop"]
                     current_round -= 1
 
+            # Legs were collected destination-first
+            legs.reverse()
+
             # Final walk
             dest_stop_info = next(d for d in dest_stops if d["stop_id"] == best_dest)
             final_walk_time = dest_stop_info["walking_time"]
             legs.append({
                 "type": "walk",
-                "from": {
-                    "lat": dest_stop_info["stop"]["lat"],
-                    "lon": dest_stop_info["stop"]["lon"],
-                    "stop_id": best_dest,
-                    "stop_name": dest_stop_info["stop"]["stop_name"]
-                },
+                "from": self._stop_fragments[best_dest],
                 "to": {"lat": dest_lat, "lon": dest_lon},
                 "distance_m": dest_stop_info["distance"],
                 "duration_seconds": final_walk_time
@@ -1,13 +1,17 @@
-import csv
+import io
 import logging
 import psycopg2
 from pathlib import Path
 from typing import Dict, List, Tuple
 from datetime import datetime, timedelta
 from collections import defaultdict
-import statistics
+from functools import lru_cache
 import os
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
 from dotenv import load_dotenv
+from db.models import COPY_CHUNK_BYTES, csv_table_columns, post_load_ddl
 
 load_dotenv()
 
@@ -16,8 +20,11 @@ logger = logging.getLogger(__name__)
 # Configuration
 GTFS_DIR = "gtfs_static"
 LOG_FILE = "arrival_log_cleaned.csv"
+LOG_CHUNK_ROWS = 1_000_000  # Arrival log rows parsed at a time
 IQR_MULTIPLIER = 3.0  # How many IQRs away to consider outlier (3.0 is more permissive than standard 1.5)
 OUTPUT_FILE = f"{GTFS_DIR}/realistic_stop_times.txt"
+# Filtered delays from the last parse, reused while LOG_FILE is unchanged
+DELAY_CACHE_FILE = f"{GTFS_DIR}/delay_stats_cache.npz"
 
 DB_CONFIG = {
     "dbname": "postgres",
@@ -28,26 +35,39 @@ DB_CONFIG = {
 }
 
 
+@lru_cache(maxsize=None)
+def _gtfs_time_table():
+    """Every HH:MM:SS string for two service days, indexed by seconds (built on first use)"""
+    return np.array(
+        [f"{h:02d}:{m:02d}:{s:02d}" for h in range(48) for m in range(60) for s in range(60)],
+        dtype=object,
+    )
+
+
 class RealisticStopTimesService:
     """Service to calculate realistic stop times based on actual arrival data"""
     
     def __init__(self):
-        self.stop_times_data = []
+        self.stop_times_data = pd.DataFrame()
         self.delay_stats = defaultdict(list)
+        self.median_delay = {}
+        # The rendered CSV, written to OUTPUT_FILE and COPYed from memory
+        self._stop_times_csv = ''
     
     def _load_static_stop_times(self):
-        """Load the original stop_times.txt"""
-        stop_times = []
+        """Load the original stop_times.txt, every column as text ('' for empty)"""
         try:
-            with open(f"{GTFS_DIR}/stop_times.txt", 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    stop_times.append(row)
+            stop_times = pd.read_csv(
+                f"{GTFS_DIR}/stop_times.txt",
+                dtype=str,
+                keep_default_na=False,
+                encoding='utf-8',
+            ).fillna('')
             logger.info(f"Loaded {len(stop_times)} stop times from static GTFS")
             return stop_times
         except Exception as e:
             logger.error(f"Error loading stop_times.txt: {e}")
-            return []
+            return pd.DataFrame()
     
     def _parse_arrival_log(self):
         """Parse arrival_log.csv and calculate delay statistics"""
@@ -55,84 +75,95 @@ class RealisticStopTimesService:
             logger.warning(f"Arrival log file {LOG_FILE} does not exist")
             return
         
+        # The log only ever grows, so size + mtime identify its contents
+        stat = os.stat(LOG_FILE)
+        fingerprint = np.array([stat.st_size, stat.st_mtime_ns], dtype=np.int64)
+        if self._load_delay_cache(fingerprint):
+            logger.info(f"Arrival log unchanged, reused delay data for {len(self.delay_stats)} unique (trip, stop) pairs")
+            return
+        
         try:
-            # First pass: collect all delays
-            raw_delays = defaultdict(list)
+            # Stream the three columns we need through pandas' C parser, as
+            # text so blanks and bad values can be counted. Only the valid
+            # rows are kept between chunks, as category codes and int delays
+            chunks = pd.read_csv(
+                LOG_FILE,
+                usecols=['trip_id', 'stop_id', 'delay_seconds'],
+                dtype=str,
+                keep_default_na=False,
+                encoding='utf-8',
+                chunksize=LOG_CHUNK_ROWS,
+            )
+            row_count = skipped_no_ids = skipped_no_delay = error_count = 0
+            trip_parts, stop_parts, delay_parts = [], [], []
             
-            with open(LOG_FILE, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                row_count = 0
-                skipped_no_ids = 0
-                skipped_no_delay = 0
-                error_count = 0
+            for log in chunks:
+                if row_count == 0:
+                    for n, row in enumerate(log.head(3).itertuples(index=False), start=1):
+                        logger.info(f"Sample row {n}: trip='{row.trip_id}', stop='{row.stop_id}', delay='{row.delay_seconds}'")
+                row_count += len(log)
+                
+                trip_ids = log['trip_id'].str.strip()
+                stop_ids = log['stop_id'].str.strip()
+                delay_str = log['delay_seconds'].str.strip()
+                
+                has_ids = (trip_ids != '') & (stop_ids != '')
+                has_delay = has_ids & (delay_str != '')
+                skipped_no_ids += int((~has_ids).sum())
+                skipped_no_delay += int((has_ids & ~has_delay).sum())
                 
-                for row in reader:
-                    row_count += 1
-                    
-                    if row_count <= 3:
-                        logger.info(f"Sample row {row_count}: trip='{row.get('trip_id', '')}', stop='{row.get('stop_id', '')}', delay='{row.get('delay_seconds', '')}'")
-                    
-                    trip_id = row.get('trip_id', '').strip()
-                    stop_id = row.get('stop_id', '').strip()
-                    delay_str = row.get('delay_seconds', '').strip()
-                    
-                    if not trip_id or not stop_id:
-                        skipped_no_ids += 1
-                        continue
-                    
-                    if not delay_str:
-                        skipped_no_delay += 1
-                        continue
-                    
-                    try:
-                        delay_seconds = int(float(delay_str))
-                        raw_delays[(trip_id, stop_id)].append(delay_seconds)
-                        
-                    except (ValueError, TypeError) as e:
-                        error_count += 1
-                        if error_count <= 5:
-                            logger.warning(f"Parse error: '{delay_str}' - {e}")
-                        continue
+                # int(float(x)) semantics: parse as float, truncate toward zero
+                delay_float = pd.to_numeric(delay_str[has_delay], errors='coerce')
+                parsed = np.isfinite(delay_float.to_numpy(dtype=np.float64, na_value=np.nan))
+                bad = delay_str[has_delay][~parsed]
+                for value in bad.head(max(5 - error_count, 0)):
+                    logger.warning(f"Parse error: '{value}' is not a number")
+                error_count += len(bad)
+                
+                valid = delay_float.index[parsed]
+                trip_parts.append(pd.Categorical(trip_ids[valid]))
+                stop_parts.append(pd.Categorical(stop_ids[valid]))
+                delay_parts.append(np.trunc(delay_float.to_numpy(dtype=np.float64)[parsed]).astype(np.int64))
+            
+            trips = union_categoricals(trip_parts) if trip_parts else pd.Categorical([])
+            stops = union_categoricals(stop_parts) if stop_parts else pd.Categorical([])
+            delays = np.concatenate(delay_parts) if delay_parts else np.empty(0, dtype=np.int64)
             
             logger.info(f"Parsed {row_count} rows from arrival log")
-            logger.info(f"Raw delays collected: {sum(len(v) for v in raw_delays.values())}")
+            logger.info(f"Raw delays collected: {len(delays)}")
             logger.info(f"Skipped - No IDs: {skipped_no_ids}, No delay: {skipped_no_delay}, Errors: {error_count}")
             
-            # Second pass: filter outliers per (trip, stop) pair using IQR method
-            total_before_filter = 0
-            total_after_filter = 0
-            outliers_removed = 0
+            # Filter outliers per (trip, stop) pair using IQR method, for all
+            # pairs at once: sort by (pair, delay) so each pair is a contiguous
+            # sorted run and Q1/Q3 are plain index reads into it
+            trip_codes = trips.codes.astype(np.int64)
+            stop_codes = stops.codes.astype(np.int64)
+            group = pd.factorize(trip_codes * len(stops.categories) + stop_codes)[0]
+            order = np.lexsort((delays, group))
+            group, delays = group[order], delays[order]
+            counts = np.bincount(group)
+            starts = np.cumsum(counts) - counts
             
-            for key, delays in raw_delays.items():
-                total_before_filter += len(delays)
-                
-                # Need at least 4 data points to calculate IQR meaningfully
-                if len(delays) < 4:
-                    self.delay_stats[key] = delays
-                    total_after_filter += len(delays)
-                    continue
-                
-                # Calculate Q1, Q3, and IQR
-                sorted_delays = sorted(delays)
-                q1_idx = len(sorted_delays) // 4
-                q3_idx = (3 * len(sorted_delays)) // 4
-                
-                q1 = sorted_delays[q1_idx]
-                q3 = sorted_delays[q3_idx]
-                iqr = q3 - q1
-                
-                # Define outlier bounds
-                lower_bound = q1 - (IQR_MULTIPLIER * iqr)
-                upper_bound = q3 + (IQR_MULTIPLIER * iqr)
-                
-                # Filter outliers
-                filtered_delays = [d for d in delays if lower_bound <= d <= upper_bound]
-                
-                outliers_removed += len(delays) - len(filtered_delays)
-                
-                if filtered_delays:
-                    self.delay_stats[key] = filtered_delays
-                    total_after_filter += len(filtered_delays)
+            q1 = delays[starts + counts // 4]
+            q3 = delays[starts + (3 * counts) // 4]
+            iqr = q3 - q1
+            lower_bound = (q1 - IQR_MULTIPLIER * iqr)[group]
+            upper_bound = (q3 + IQR_MULTIPLIER * iqr)[group]
+            
+            # Need at least 4 data points to calculate IQR meaningfully
+            keep = (counts[group] < 4) | ((lower_bound <= delays) & (delays <= upper_bound))
+            kept_counts = np.bincount(group[keep], minlength=len(counts))
+            
+            total_before_filter = len(delays)
+            total_after_filter = int(keep.sum())
+            outliers_removed = total_before_filter - total_after_filter
+            
+            first_rows = order[starts]
+            pair_trips = np.asarray(trips.categories, dtype=object)[trip_codes[first_rows]]
+            pair_stops = np.asarray(stops.categories, dtype=object)[stop_codes[first_rows]]
+            kept = delays[keep]
+            self._store_delay_stats(pair_trips, pair_stops, kept, kept_counts)
+            self._save_delay_cache(fingerprint, pair_trips, pair_stops, kept, kept_counts)
             
             logger.info(f"Outlier filtering complete:")
             logger.info(f"  Before: {total_before_filter} delays")
@@ -145,59 +176,97 @@ class RealisticStopTimesService:
             import traceback
             traceback.print_exc()
     
-    def _calculate_average_delay(self, trip_id, stop_id):
-        """Calculate average delay for a specific trip and stop"""
-        key = (trip_id, stop_id)
+    def _store_delay_stats(self, pair_trips, pair_stops, kept, kept_counts):
+        """
+        Fill delay_stats and median_delay from the filtered delays: kept holds
+        every pair's delays as consecutive sorted runs of kept_counts each.
+        """
+        # All kept delays live in one contiguous array; each pair's entry
+        # in delay_stats is a sorted view into it, not a list of ints
+        kept_starts = np.cumsum(kept_counts) - kept_counts
+        runs = np.split(kept, kept_starts[1:])
         
-        if key not in self.delay_stats or not self.delay_stats[key]:
-            return 0
-        
-        delays = self.delay_stats[key]
-        return int(statistics.median(delays))
+        # Median of each sorted run, as int(statistics.median(run)):
+        # mean of the two middle values, truncated toward zero
+        medians = np.trunc(
+            (kept[kept_starts + (kept_counts - 1) // 2] + kept[kept_starts + kept_counts // 2]) / 2
+        ).astype(np.int64).tolist()
+        for key, filtered_delays, median in zip(zip(pair_trips, pair_stops), runs, medians):
+            self.delay_stats[key] = filtered_delays
+            self.median_delay[key] = median
     
-    def _adjust_gtfs_time(self, time_str, delay_seconds):
-        """Adjust GTFS time string by adding delay_seconds"""
+    def _load_delay_cache(self, fingerprint):
+        """Restore delay statistics saved for this exact log and outlier threshold, False if there are none"""
+        if not Path(DELAY_CACHE_FILE).exists():
+            return False
         try:
-            if not time_str:
-                return time_str
-            
-            parts = time_str.split(":")
-            if len(parts) != 3:
-                return time_str
-            
-            hours = int(parts[0])
-            minutes = int(parts[1])
-            seconds = int(parts[2])
-            
-            total_seconds = hours * 3600 + minutes * 60 + seconds
-            adjusted_seconds = total_seconds + delay_seconds
-            
-            if adjusted_seconds < 0:
-                adjusted_seconds = 0
-            
-            adj_hours = adjusted_seconds // 3600
-            adj_minutes = (adjusted_seconds % 3600) // 60
-            adj_secs = adjusted_seconds % 60
-            
-            return f"{adj_hours:02d}:{adj_minutes:02d}:{adj_secs:02d}"
-            
+            with np.load(DELAY_CACHE_FILE) as cache:
+                if not np.array_equal(cache['fingerprint'], fingerprint):
+                    return False
+                # The kept delays depend on the threshold as much as on the log
+                if 'iqr_multiplier' not in cache.files or cache['iqr_multiplier'] != IQR_MULTIPLIER:
+                    return False
+                self._store_delay_stats(
+                    cache['pair_trips'].tolist(), cache['pair_stops'].tolist(),
+                    cache['kept'], cache['kept_counts'],
+                )
+            return True
         except Exception as e:
-            logger.error(f"Error adjusting time {time_str}: {e}")
-            return time_str
+            logger.warning(f"Ignoring unreadable delay cache {DELAY_CACHE_FILE}: {e}")
+            return False
+    
+    def _save_delay_cache(self, fingerprint, pair_trips, pair_stops, kept, kept_counts):
+        """Save the filtered delays so an unchanged log isn't parsed again"""
+        try:
+            # Fixed-width string arrays, so loading never needs pickle
+            np.savez(
+                DELAY_CACHE_FILE,
+                fingerprint=fingerprint,
+                iqr_multiplier=np.float64(IQR_MULTIPLIER),
+                pair_trips=pair_trips.astype(str),
+                pair_stops=pair_stops.astype(str),
+                kept=kept,
+                kept_counts=kept_counts,
+            )
+        except Exception as e:
+            logger.warning(f"Could not save delay cache {DELAY_CACHE_FILE}: {e}")
+    
+    def _calculate_average_delay(self, trip_id, stop_id):
+        """Median delay for a specific trip and stop, precomputed by _parse_arrival_log"""
+        return self.median_delay.get((trip_id, stop_id), 0)
+    
+    @staticmethod
+    def _gtfs_time_to_seconds(times):
+        """HH:MM:SS strings (hours may exceed 23) to an int64 array of seconds"""
+        parts = pd.Series(times).str.split(':', expand=True).reindex(columns=range(3))
+        return parts.astype(np.int64).to_numpy() @ np.array([3600, 60, 1], dtype=np.int64)
+    
+    @staticmethod
+    def _seconds_to_gtfs_time(seconds):
+        """Seconds array back to zero-padded HH:MM:SS strings"""
+        seconds = np.asarray(seconds, dtype=np.int64)
+        table = _gtfs_time_table()
+        in_table = seconds < len(table)
+        times = np.empty(len(seconds), dtype=object)
+        times[in_table] = table[seconds[in_table]]
+        # Anything past the table's two service days is formatted by hand
+        for i in np.flatnonzero(~in_table).tolist():
+            h, rest = divmod(int(seconds[i]), 3600)
+            times[i] = f"{h:02d}:{rest // 60:02d}:{rest % 60:02d}"
+        return times
     
     def _write_realistic_stop_times(self):
         """Write realistic stop times to file"""
         try:
-            if not self.stop_times_data:
+            if self.stop_times_data.empty:
                 logger.error("No data to write")
                 return False
             
-            headers = list(self.stop_times_data[0].keys())
-            
+            # pandas' C writer; CRLF like the csv module wrote before. Rendered
+            # once and kept so the database load doesn't read the file back
+            self._stop_times_csv = self.stop_times_data.to_csv(index=False, lineterminator='\r\n')
             with open(OUTPUT_FILE, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.DictWriter(f, fieldnames=headers)
-                writer.writeheader()
-                writer.writerows(self.stop_times_data)
+                f.write(self._stop_times_csv)
             
             logger.info(f"Successfully wrote realistic stop times to {OUTPUT_FILE}")
             return True
@@ -206,13 +275,9 @@ class RealisticStopTimesService:
             logger.error(f"Error writing realistic stop times: {e}")
             return False
     
-    def _create_table_from_csv(self, cursor, table_name, csv_path):
-        """Create database table from CSV file"""
-        with open(csv_path, newline="", encoding="utf-8") as f:
-            reader = csv.reader(f)
-            headers = next(reader)
-
-        columns = ", ".join(f'"{h}" TEXT' for h in headers)
+    def _create_table(self, cursor, table_name, headers):
+        """Create database table with a column per header, typed like the model"""
+        columns = csv_table_columns(table_name, headers)
 
         cursor.execute(f"""
             DROP TABLE IF EXISTS "{table_name}";
@@ -222,17 +287,17 @@ class RealisticStopTimesService:
         """)
         logger.info(f"Created table '{table_name}'")
     
-    def _load_csv_into_table(self, cursor, table_name, csv_path):
-        """Load CSV data into database table"""
-        with open(csv_path, "r", encoding="utf-8") as f:
-            cursor.copy_expert(
-                f'COPY "{table_name}" FROM STDIN WITH CSV HEADER',
-                f
-            )
+    def _load_csv_into_table(self, cursor, table_name, csv_file):
+        """Load CSV data from a file-like object into database table"""
+        cursor.copy_expert(
+            f'COPY "{table_name}" FROM STDIN WITH CSV HEADER',
+            csv_file,
+            size=COPY_CHUNK_BYTES,
+        )
         logger.info(f"Loaded data into table '{table_name}'")
     
     def _push_to_database(self):
-        """Push realistic_stop_times.txt to database"""
+        """Push the realistic stop times written by _write_realistic_stop_times to database"""
         try:
             logger.info("Connecting to database...")
             conn = psycopg2.connect(**DB_CONFIG)
@@ -241,8 +306,11 @@ class RealisticStopTimesService:
             table_name = "realistic_stop_times"
             
             logger.info(f"Creating and populating '{table_name}' table...")
-            self._create_table_from_csv(cur, table_name, OUTPUT_FILE)
-            self._load_csv_into_table(cur, table_name, OUTPUT_FILE)
+            headers = list(self.stop_times_data.columns)
+            self._create_table(cur, table_name, headers)
+            self._load_csv_into_table(cur, table_name, io.StringIO(self._stop_times_csv))
+            for statement in post_load_ddl(table_name, headers):
+                cur.execute(statement)
             
             conn.commit()
             cur.close()
@@ -260,67 +328,64 @@ class RealisticStopTimesService:
         logger.info("Starting realistic stop times calculation")
         
         self.stop_times_data = self._load_static_stop_times()
-        if not self.stop_times_data:
+        if self.stop_times_data.empty:
             logger.error("No stop times data loaded")
             return False
         
         self._parse_arrival_log()
         
-        # Group stop_times by trip_id to process each trip independently
-        trips_dict = defaultdict(list)
-        for stop_time in self.stop_times_data:
-            trip_id = stop_time.get('trip_id', '')
-            if trip_id:
-                trips_dict[trip_id].append(stop_time)
+        stop_times = self.stop_times_data
+        trip_ids = stop_times['trip_id'].to_numpy()
+        stop_ids = stop_times['stop_id'].to_numpy()
+        arrivals = stop_times['arrival_time'].to_numpy()
         
-        # Sort each trip's stops by stop_sequence
-        for trip_id in trips_dict:
-            trips_dict[trip_id].sort(key=lambda x: int(x.get('stop_sequence', 0)))
+        # Rows to adjust, each trip's stops in stop_sequence order (stable, so
+        # equal sequences keep file order)
+        rows = np.flatnonzero((trip_ids != '') & (arrivals != ''))
+        trip_codes = pd.factorize(trip_ids[rows])[0]
+        sequences = stop_times['stop_sequence'].to_numpy()[rows].astype(np.int64)
+        order = np.lexsort((sequences, trip_codes))
+        rows, trip_codes = rows[order], trip_codes[order]
         
-        adjusted_count = 0
-        enforced_count = 0
+        # Apply each stop's median delay to the whole column at once
+        original_arrivals = arrivals[rows]
+        delays = np.fromiter(
+            map(self._calculate_average_delay, trip_ids[rows], stop_ids[rows]),
+            dtype=np.int64,
+            count=len(rows),
+        )
+        delayed = delays != 0
+        seconds = self._gtfs_time_to_seconds(original_arrivals)
+        seconds[delayed] = np.maximum(seconds[delayed] + delays[delayed], 0)
+        adjusted_count = int(delayed.sum())
         
-        # Process each trip to ensure monotonic time progression
-        for trip_id, stops in trips_dict.items():
-            prev_time_seconds = None
-            
-            for stop_time in stops:
-                stop_id = stop_time.get('stop_id', '')
-                original_arrival = stop_time.get('arrival_time', '')
-                
-                if not original_arrival:
-                    continue
-                
-                # Calculate the delay for this stop
-                avg_delay = self._calculate_average_delay(trip_id, stop_id)
-                
-                # Apply the delay
-                if avg_delay != 0:
-                    adjusted_arrival = self._adjust_gtfs_time(original_arrival, avg_delay)
-                    adjusted_count += 1
-                else:
-                    adjusted_arrival = original_arrival
-                
-                # Convert to seconds for comparison
-                parts = adjusted_arrival.split(":")
-                current_time_seconds = int(parts[0]) * 3600 + int(parts[1]) * 60 + int(parts[2])
-                
-                # Enforce monotonic progression: if current time <= previous time, set it to previous + 1 minute
-                if prev_time_seconds is not None and current_time_seconds <= prev_time_seconds:
-                    current_time_seconds = prev_time_seconds + 60  # Add 1 minute
-                    enforced_count += 1
-                    
-                    # Convert back to time string
-                    adj_hours = current_time_seconds // 3600
-                    adj_minutes = (current_time_seconds % 3600) // 60
-                    adj_secs = current_time_seconds % 60
-                    adjusted_arrival = f"{adj_hours:02d}:{adj_minutes:02d}:{adj_secs:02d}"
-                
-                # Update the stop time
-                stop_time['arrival_time'] = adjusted_arrival
-                stop_time['departure_time'] = adjusted_arrival
-                
-                prev_time_seconds = current_time_seconds
+        # Enforce monotonic progression: if current time <= previous time, set it to previous + 1 minute.
+        # Solved as whole-array sweeps: each sweep settles at least one more
+        # stop of every trip, and only stops whose predecessor moved are
+        # revisited, so trips without violations cost a single pass
+        has_prev = np.zeros(len(rows), dtype=bool)
+        has_prev[1:] = trip_codes[1:] == trip_codes[:-1]
+        adjusted = seconds.copy()
+        active = np.flatnonzero(has_prev)
+        while len(active):
+            prev_time_seconds = adjusted[active - 1]
+            current = seconds[active]
+            settled = np.where(current <= prev_time_seconds, prev_time_seconds + 60, current)
+            moved = active[settled != adjusted[active]]
+            adjusted[active] = settled
+            following = moved + 1
+            following = following[following < len(rows)]
+            active = following[has_prev[following]]
+        # A stop only ends up off its delayed time when it was pushed forward
+        enforced = adjusted != seconds
+        enforced_count = int(enforced.sum())
+        
+        # Only rewrite the strings that changed, the rest keep their original text
+        changed = delayed | enforced
+        new_arrivals = original_arrivals.copy()
+        new_arrivals[changed] = self._seconds_to_gtfs_time(adjusted[changed])
+        for column in ('arrival_time', 'departure_time'):
+            stop_times.iloc[rows, stop_times.columns.get_loc(column)] = new_arrivals
         
         logger.info(f"Adjusted {adjusted_count} stop times based on actual data")
         logger.info(f"Enforced monotonic progression on {enforced_count} stops")
@@ -339,21 +404,20 @@ class RealisticStopTimesService:
         if not self.delay_stats:
             return {}
         
-        all_delays = []
-        for delays in self.delay_stats.values():
-            all_delays.extend(delays)
+        # One preallocated array, then C reductions over it
+        all_delays = np.concatenate(list(self.delay_stats.values()))
         
-        if not all_delays:
+        if not len(all_delays):
             return {}
         
         return {
             'total_observations': len(all_delays),
             'unique_trip_stop_pairs': len(self.delay_stats),
-            'median_delay_seconds': statistics.median(all_delays),
-            'mean_delay_seconds': statistics.mean(all_delays),
-            'min_delay_seconds': min(all_delays),
-            'max_delay_seconds': max(all_delays),
-            'stdev_delay_seconds': statistics.stdev(all_delays) if len(all_delays) > 1 else 0
+            'median_delay_seconds': float(np.median(all_delays)),
+            'mean_delay_seconds': float(all_delays.mean()),
+            'min_delay_seconds': int(all_delays.min()),
+            'max_delay_seconds': int(all_delays.max()),
+            'stdev_delay_seconds': float(all_delays.std(ddof=1)) if len(all_delays) > 1 else 0
         }
 
 
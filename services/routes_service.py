@@ -1,3 +1,5 @@
+from threading import Lock
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from db.models import Route
 
@@ -8,19 +10,39 @@ ROUTE_TYPE_PREFIX = {
     "3": "A",
 }
 
+# Loaded on first lookup and kept for the process: services are built per
+# request, and the routes only change with a GTFS reload, which restarts the app
+_reallife_ids_cache = {"reallife_ids": None}
+_reallife_ids_lock = Lock()
+
 class RoutesService:
     def __init__(self, db: Session):
         self.db = db
 
     def get_reallife_id(self, route_id: str) -> str | None:
-        route = (
-            self.db.query(Route)
-            .filter(Route.route_id == route_id)
-            .first()
-        )
+        return self.get_reallife_id_map().get(route_id)
+
+    def get_reallife_id_map(self) -> dict[str, str]:
+        """route_id -> reallife id for every route that has a short name (shared, don't modify)"""
+        reallife_ids = _reallife_ids_cache["reallife_ids"]
+        if reallife_ids is None:
+            with _reallife_ids_lock:
+                reallife_ids = _reallife_ids_cache["reallife_ids"]
+                if reallife_ids is None:
+                    reallife_ids = _reallife_ids_cache["reallife_ids"] = self._load_reallife_id_map()
+        return reallife_ids
 
-        if not route or not route.route_short_name:
-            return None
+    def _load_reallife_id_map(self) -> dict[str, str]:
+        rows = self.db.execute(
+            select(Route.route_id, Route.route_type, Route.route_short_name)
+        ).all()
+        return {
+            route_id: self._format_reallife_id(route_type, short_name)
+            for route_id, route_type, short_name in rows
+            if short_name
+        }
 
-        prefix = ROUTE_TYPE_PREFIX.get(str(route.route_type), "")
-        return f"{prefix}{route.route_short_name}"
+    @staticmethod
+    def _format_reallife_id(route_type, route_short_name) -> str:
+        prefix = ROUTE_TYPE_PREFIX.get(str(route_type), "")
+        return f"{prefix}{route_short_name}"
@@ -92,7 +92,7 @@ class StopsService:
             if seconds_to_arrival <= REALTIME_GRACE_MINUTES * 60 and not has_vehicle:
                 continue
 
-            route_code = a.trip_id.split("-")[0]
+            route_code = a.trip_id.partition("-")[0]
             real_life_route_id = self.routes_service.get_reallife_id(route_code)
 
             arrival_obj = {
@@ -123,8 +123,8 @@ class StopsService:
         routes = defaultdict(list)
 
         for a in arrivals:
-            route_id = a["trip_id"].split("-")[0]
-            routes[route_id].append(a)
+            # route_id is the trip_id prefix, already split off when the arrival was built
+            routes[a["route_id"]].append(a)
 
         filtered = []
 
@@ -1,8 +1,8 @@
 from datetime import datetime, timedelta
 from collections import defaultdict
-from typing import Any
+from sqlalchemy import select, func, or_, and_
 from sqlalchemy.orm import Session
-from db.models import StopTime, Stop, Trip, RealisticStopTime, CalendarDate
+from db.models import StopTime, Stop, Trip, RealisticStopTime, CalendarDate, STOP_CODE_LENGTH
 from services.vehicle_positions import fetch_vehicle_positions
 from services.routes_service import RoutesService
 from services.arrival_logger import arrival_logger
@@ -10,8 +10,12 @@ from services.arrival_logger import arrival_logger
 # Threshold in minutes to consider a bus "ghost" if no realtime info
 REALTIME_GRACE_MINUTES = 7
 
-# How long (in seconds) we trust last seen GPS before downgrading
-VEHICLE_POSITION_TTL_SECONDS = 30
+# Arrivals expected further out than this are not returned
+ARRIVALS_HORIZON_SECONDS = 7200
+
+# Largest early delay a bus can show up with (clean_log drops delays beyond ±2h),
+# so scheduled times up to this far past the horizon are still fetched
+MAX_EARLY_SECONDS = 7200
 
 
 class StopsService:
@@ -19,9 +23,6 @@ class StopsService:
         self.db = db
         self.routes_service = RoutesService(db)
 
-        # trip_id -> { "position": {...}, "last_seen": datetime }
-        self.vehicle_cache: dict[str, dict[str, Any]] = {}
-
     def seconds_until(self, arrival_hms: str) -> int:
         """Compute seconds until arrival from HH:MM:SS string, handling hours > 23"""
         try:
@@ -38,11 +39,92 @@ class StopsService:
 
         return int((arrival - now).total_seconds())
 
-    def get_all_stops(self):
+    @staticmethod
+    def _seconds_of_day(now: datetime) -> int:
+        return now.hour * 3600 + now.minute * 60 + now.second
+
+    # Only the columns the arrival builders read, as plain rows
+    _ARRIVAL_COLUMNS = (
+        StopTime.trip_id,
+        StopTime.stop_id,
+        StopTime.arrival_time,
+        StopTime.departure_time,
+        StopTime.stop_sequence,
+        StopTime.stop_headsign,
+        # Pre-parsed seconds of day, so the per-arrival math stays on ints
+        StopTime.arrival_sec,
+        Trip.trip_headsign,
+        # From the outer join below, None without a realistic time
+        RealisticStopTime.arrival_sec.label("realistic_arrival_sec"),
+    )
+
+    # The realistic stop time for the same visit, fetched in the same query
+    _REALISTIC_JOIN = and_(
+        RealisticStopTime.trip_id == StopTime.trip_id,
+        RealisticStopTime.stop_id == StopTime.stop_id,
+        RealisticStopTime.stop_sequence == StopTime.stop_sequence,
+    )
+
+    @staticmethod
+    def _all_stops_query():
+        # Stops without a code fall back to the stop_id minus its type prefix
+        stop_code = func.coalesce(
+            func.nullif(Stop.stop_code, ""), func.substr(Stop.stop_id, 2)
+        )
         return (
-            self.db.query(Stop)
+            select(
+                Stop.stop_id,
+                stop_code.label("stop_code"),
+                Stop.stop_name,
+                Stop.stop_desc,
+                Stop.stop_lat,
+                Stop.stop_lon,
+                Stop.location_type,
+                Stop.parent_station,
+                Stop.stop_timezone,
+                Stop.level_id,
+            )
             .join(StopTime, Stop.stop_id == StopTime.stop_id)
             .distinct()
+        )
+
+    def get_all_stops(self):
+        """Return served stops as lightweight row mappings, ready to serialize"""
+        return self.db.execute(self._all_stops_query()).mappings().all()
+
+    def iter_all_stops(self, batch_size: int = 1000):
+        """
+        Stream served stops in batches of row mappings using a server-side
+        cursor, so only one batch is resident at a time.
+        """
+        result = self.db.execute(
+            self._all_stops_query().execution_options(
+                stream_results=True, yield_per=batch_size
+            )
+        )
+        yield from result.mappings().partitions()
+
+    def get_arrivals_by_stop(self, stop_id: str):
+        """Return all static stop times for a stop as row mappings"""
+        return (
+            self.db.execute(
+                select(
+                    StopTime.trip_id,
+                    StopTime.arrival_time,
+                    StopTime.departure_time,
+                    StopTime.stop_sequence,
+                    StopTime.stop_headsign,
+                    StopTime.pickup_type,
+                    StopTime.drop_off_type,
+                    StopTime.shape_dist_traveled,
+                    StopTime.continuous_pickup,
+                    StopTime.continuous_drop_off,
+                    StopTime.timepoint,
+                )
+                .filter(StopTime.stop_id == stop_id)
+                .order_by(StopTime.arrival_sec)
+            )
+            .mappings()
             .all()
         )
 
@@ -50,138 +132,160 @@ class StopsService:
         """Fetch latest arrival info from in-memory logger for a given trip_id"""
         return arrival_logger.get_latest_arrival(trip_id)
 
-    def _calculate_historic_latency_from_cache(self, static_arrival_time: str, trip_id: str, stop_id: str, stop_sequence: int, realistic_times: dict) -> tuple[int | None, str]:
+    def _calculate_historic_latency(self, static_arrival_sec: int | None, realistic_arrival_sec: int | None) -> tuple[int | None, str]:
         """
-        Calculate historic latency using pre-fetched realistic times.
+        Calculate historic latency from the static and realistic arrival times
+        (GTFS seconds of day, so hours >= 24 are already accounted for).
         Returns (latency_minutes, relationship_status)
         """
-        try:
-            key = (trip_id, stop_id, stop_sequence)
-            realistic_arrival_time = realistic_times.get(key)
-
-            if not realistic_arrival_time:
-                return None, "on time"
-
-            # Parse both times (both use GTFS format with hours >= 24)
-            static_h, static_m, static_s = map(int, static_arrival_time.split(":"))
-            realistic_h, realistic_m, realistic_s = map(int, realistic_arrival_time.split(":"))
-
-            # Convert to total seconds
-            static_seconds = static_h * 3600 + static_m * 60 + static_s
-            realistic_seconds = realistic_h * 3600 + realistic_m * 60 + realistic_s
+        if static_arrival_sec is None or realistic_arrival_sec is None:
+            return None, "on time"
 
-            # Calculate difference in minutes (realistic - static)
-            diff_seconds = realistic_seconds - static_seconds
-            diff_minutes = round(diff_seconds / 60)
+        # Calculate difference in minutes (realistic - static)
+        diff_seconds = realistic_arrival_sec - static_arrival_sec
+        diff_minutes = round(diff_seconds / 60)
 
-            # Determine relationship status
-            if diff_minutes > 1:
-                relationship = "late"
-            elif diff_minutes < -1:
-                relationship = "early"
-            else:
-                relationship = "on time"
+        # Determine relationship status
+        if diff_minutes > 1:
+            relationship = "late"
+        elif diff_minutes < -1:
+            relationship = "early"
+        else:
+            relationship = "on time"
 
-            return diff_minutes, relationship
+        return diff_minutes, relationship
 
-        except Exception:
-            return None, "on time"
+    @staticmethod
+    def _is_metro_stop(stop_code: str) -> bool:
+        # Metro stops are 'M' followed by digits
+        return stop_code.upper().startswith('M') and len(stop_code) > 1 and stop_code[1:].isdigit()
 
     def get_future_arrivals_by_stop(self, stop_code: str):
-        # Check if this is a metro stop (starts with 'M' followed by digits)
-        if stop_code.upper().startswith('M') and len(stop_code) > 1 and stop_code[1:].isdigit():
+        if self._is_metro_stop(stop_code):
             return self.get_future_metro_arrivals(stop_code)
     
         # ===== BUS LOGIC BELOW =====
         now = datetime.now()
-        current_time = now.strftime("%H:%M:%S")
-    
-        # Calculate time 1 hour ago to catch late buses
-        one_hour_ago = (now - timedelta(hours=1)).strftime("%H:%M:%S")
-    
-        # Load arrivals from 1 hour ago to future (JOIN trips)
+        static_arrivals = self._query_bus_arrivals(self._bus_stop_filter(stop_code), now)
+
+        # Fetch latest live vehicle positions. The service lives for a single
+        # request and the shared feed is only seconds old (see
+        # services/vehicle_positions.py), so a trip has a live vehicle exactly
+        # when it is in this feed
+        latest_positions = fetch_vehicle_positions()
+
+        return self._build_bus_arrivals(
+            static_arrivals, stop_code, self._seconds_of_day(now), latest_positions
+        )
+
+    def get_future_arrivals_for_stops(self, stop_codes: list[str]) -> dict[str, list]:
+        """
+        Future arrivals for several stops at once: one query for all bus stops
+        and one vehicle positions fetch, bucketed per requested code locally.
+        """
+        result = {}
+        bus_codes = []
+        for stop_code in dict.fromkeys(stop_codes):
+            if self._is_metro_stop(stop_code):
+                result[stop_code] = self.get_future_metro_arrivals(stop_code)
+            else:
+                bus_codes.append(stop_code)
+
+        if not bus_codes:
+            return result
+
         now = datetime.now()
+        static_arrivals = self._query_bus_arrivals(
+            or_(*(self._bus_stop_filter(code) for code in bus_codes)), now
+        )
+
+        # Same matching as the per-stop filters, applied to each row
+        by_suffix = defaultdict(list)
+        short_codes = []
+        for stop_code in bus_codes:
+            if len(stop_code) >= STOP_CODE_LENGTH:
+                by_suffix[stop_code[-STOP_CODE_LENGTH:].lower()].append(stop_code)
+            else:
+                short_codes.append(stop_code)
+
+        rows_by_code = {stop_code: [] for stop_code in bus_codes}
+        for a in static_arrivals:
+            stop_id = a.stop_id.lower()
+            for stop_code in by_suffix.get(stop_id[-STOP_CODE_LENGTH:], ()):
+                rows_by_code[stop_code].append(a)
+            for stop_code in short_codes:
+                if stop_id.endswith(stop_code.lower()):
+                    rows_by_code[stop_code].append(a)
+
+        latest_positions = fetch_vehicle_positions()
+        now_sec = self._seconds_of_day(now)
+        for stop_code, rows in rows_by_code.items():
+            result[stop_code] = self._build_bus_arrivals(rows, stop_code, now_sec, latest_positions)
+        return result
+
+    @staticmethod
+    def _bus_stop_filter(stop_code: str):
+        # Suffix match on the stored stop_code column (indexed with arrival_sec);
+        # codes shorter than it can only be matched with a pattern
+        if len(stop_code) >= STOP_CODE_LENGTH:
+            return StopTime.stop_code == stop_code[-STOP_CODE_LENGTH:].lower()
+        return StopTime.stop_id.ilike(f"%{stop_code}")
+
+    def _query_bus_arrivals(self, stop_filter, now: datetime):
+        """Today's scheduled bus arrivals matching stop_filter, ordered by time"""
+        # Calculate time 1 hour ago to catch late buses (seconds of day)
+        one_hour_ago_sec = self._seconds_of_day(now - timedelta(hours=1))
 
         # If it's before 4:20 AM, use yesterday's date for service lookup
         if now.hour < 4 or (now.hour == 4 and now.minute < 20):
             today = (now - timedelta(days=1)).strftime("%Y%m%d")
         else:
             today = now.strftime("%Y%m%d")
-        
-        static_arrivals = (
-            self.db.query(StopTime, Trip)
+
+        # Upper bound matching the horizon check in _build_bus_arrivals, for
+        # both today's times and the past-midnight (hour >= 24) ones
+        latest_sec = self._seconds_of_day(now) + ARRIVALS_HORIZON_SECONDS + MAX_EARLY_SECONDS
+        within_horizon = or_(
+            StopTime.arrival_sec <= latest_sec,
+            StopTime.arrival_sec.between(24 * 3600, 24 * 3600 + latest_sec),
+        )
+
+        return (
+            self.db.query(*self._ARRIVAL_COLUMNS)
             .join(Trip, Trip.trip_id == StopTime.trip_id)
             .join(CalendarDate, CalendarDate.service_id == Trip.service_id)
-            .filter(StopTime.stop_id.ilike(f"%{stop_code[-4:]}"))
-            .filter(StopTime.arrival_time >= one_hour_ago)
+            .outerjoin(RealisticStopTime, self._REALISTIC_JOIN)
+            .filter(stop_filter)
+            .filter(StopTime.arrival_sec >= one_hour_ago_sec)
+            .filter(within_horizon)
             .filter(CalendarDate.date == today)
             .filter(CalendarDate.exception_type == "1")  # Service is added on this date
-            .order_by(StopTime.arrival_time)
+            .order_by(StopTime.arrival_sec)
             .all()
         )
-        
-
-        # Batch query all realistic stop times at once
-        trip_ids = [a.trip_id for a, _ in static_arrivals]
-        realistic_times = {}
-        if trip_ids:
-            realistic_results = (
-                self.db.query(RealisticStopTime)
-                .filter(
-                    RealisticStopTime.trip_id.in_(trip_ids),
-                    RealisticStopTime.stop_id.ilike(f"%{stop_code}")
-                )
-                .all()
-            )
-            # Create lookup dict: (trip_id, stop_id, stop_sequence) -> arrival_time
-            for r in realistic_results:
-                key = (r.trip_id, r.stop_id, r.stop_sequence)
-                realistic_times[key] = r.arrival_time
-    
-        # Fetch latest live vehicle positions
-        latest_positions = fetch_vehicle_positions()
-    
-        # -------------------------------
-        # Update cache with fresh data (only if we got new positions)
-        # Keep old entries if vehicle temporarily disappears
-        # -------------------------------
-        for trip_id, position in latest_positions.items():
-            self.vehicle_cache[trip_id] = {
-                "position": position,
-                "last_seen": now,
-            }
-        
-        # Clean up very old entries (older than 5 minutes)
-        stale_threshold = now - timedelta(seconds=300)
-        stale_trips = [
-            trip_id for trip_id, data in self.vehicle_cache.items()
-            if data["last_seen"] < stale_threshold
-        ]
-        for trip_id in stale_trips:
-            del self.vehicle_cache[trip_id]
-    
+
+    def _build_bus_arrivals(self, static_arrivals, stop_code: str, now_sec: int, latest_positions: dict) -> list:
+        # Realistic times only count for stop ids ending in the full code
+        code_suffix = stop_code.lower()
+
         output = []
     
-        for a, trip in static_arrivals:
-            cached = self.vehicle_cache.get(a.trip_id)
-            has_vehicle = False
-            vehicle_position = None
-            vehicle_id = None
-    
-            if cached:
-                age = (now - cached["last_seen"]).total_seconds()
-                if age <= VEHICLE_POSITION_TTL_SECONDS:
-                    has_vehicle = True
-                    vehicle_position = cached["position"]
-                    vehicle_id = vehicle_position.get("vehicle_id") if vehicle_position else None
+        for a in static_arrivals:
+            vehicle_position = latest_positions.get(a.trip_id)
+            has_vehicle = vehicle_position is not None
+            vehicle_id = vehicle_position.get("vehicle_id") if vehicle_position else None
     
             # Get latest arrival info from logger (has its own 60s TTL cache)
             latest_arrival = self.get_latest_arrival_from_logger(a.trip_id)
 
-            # Calculate historic latency using pre-fetched data
-            historic_latency, historic_relationship = self._calculate_historic_latency_from_cache(
-                a.arrival_time, a.trip_id, a.stop_id, a.stop_sequence, realistic_times
+            # Calculate historic latency using the joined realistic time
+            realistic_arrival_sec = (
+                a.realistic_arrival_sec if a.stop_id.lower().endswith(code_suffix) else None
+            )
+            historic_latency, historic_relationship = self._calculate_historic_latency(
+                a.arrival_sec, realistic_arrival_sec
             )
+            seconds_until = a.arrival_sec - now_sec
     
             certainty = "scheduled"
             include_arrival = False
@@ -203,33 +307,30 @@ class StopsService:
                     if not has_vehicle:
                         has_vehicle = True
                 # Bus is at or near this stop (same stop sequence)
-                elif self.seconds_until(a.arrival_time) > 0:
+                elif seconds_until > 0:
                     certainty = "realtime" if (has_vehicle or latest_arrival) else "scheduled"
                     include_arrival = True
             else:
                 # No realtime data - use scheduled time if it's in the future
-                if self.seconds_until(a.arrival_time) > 0:
+                if seconds_until > 0:
                     certainty = "scheduled" if not has_vehicle else "realtime"
                     include_arrival = True
     
             if not include_arrival:
                 continue
             
-            route_code = a.trip_id.split("-")[0]
+            route_code = a.trip_id.partition("-")[0]
             real_life_route_id = self.routes_service.get_reallife_id(route_code)
     
             expected_arrival_time = a.arrival_time
+            expected_seconds = a.arrival_sec
             if delay_seconds is not None:
-                try:
-                    h, m, s = map(int, a.arrival_time.split(":"))
-                    # Keep GTFS format - don't normalize hours
-                    total_seconds = h * 3600 + m * 60 + s + delay_seconds
-                    new_h = total_seconds // 3600
-                    new_m = (total_seconds % 3600) // 60
-                    new_s = total_seconds % 60
-                    expected_arrival_time = f"{new_h:02d}:{new_m:02d}:{new_s:02d}"
-                except Exception:
-                    expected_arrival_time = a.arrival_time
+                # Keep GTFS format - don't normalize hours
+                expected_seconds += delay_seconds
+                new_h = expected_seconds // 3600
+                new_m = (expected_seconds % 3600) // 60
+                new_s = expected_seconds % 60
+                expected_arrival_time = f"{new_h:02d}:{new_m:02d}:{new_s:02d}"
     
             schedule_relationship_status = "on time"
             if delay_seconds is not None:
@@ -239,20 +340,12 @@ class StopsService:
                     schedule_relationship_status = "early"
     
             # Filter out arrivals more than 2 hours in the future
-            try:
-                h, m, s = map(int, expected_arrival_time.split(":"))
-                # Convert GTFS time to seconds for comparison
-                expected_seconds = h * 3600 + m * 60 + s
-                now_h = now.hour
-                now_seconds = now_h * 3600 + now.minute * 60 + now.second
-                # If expected time has hours >= 24, it's next day
-                if h >= 24:
-                    now_seconds += 24 * 3600  # Treat current time as if it's "yesterday"
-                diff_seconds = expected_seconds - now_seconds
-                if diff_seconds > 7200:  # 2 hours in seconds
-                    continue
-            except Exception:
-                pass
+            now_seconds = now_sec
+            # If expected time has hours >= 24, it's next day
+            if expected_seconds >= 24 * 3600:
+                now_seconds += 24 * 3600  # Treat current time as if it's "yesterday"
+            if expected_seconds - now_seconds > ARRIVALS_HORIZON_SECONDS:
+                continue
             
             arrival_obj = {
                 "trip_id": a.trip_id,
@@ -264,7 +357,7 @@ class StopsService:
                 "departure_time": a.departure_time,
                 "stop_sequence": a.stop_sequence,
                 "stop_headsign": a.stop_headsign,
-                "trip_headsign": trip.trip_headsign,
+                "trip_headsign": a.trip_headsign,
                 "vehicle_position": vehicle_position,
                 "vehicle_id": vehicle_id,
                 "certainty": certainty,
@@ -295,59 +388,47 @@ class StopsService:
                 filtered.extend(route_arrivals)
                 continue
 
-            for i, arrival in enumerate(route_arrivals):
+            # Sweep from the end: a scheduled arrival is a ghost if a realtime
+            # one is scheduled strictly later. Going backwards, the first
+            # realtime arrival seen is the latest one
+            kept = []
+            latest_realtime = None
+            for arrival in reversed(route_arrivals):
                 if arrival["certainty"] == "realtime":
-                    filtered.append(arrival)
-                else:
-                    has_realtime_after = any(
-                        route_arrivals[j]["certainty"] == "realtime"
-                        and route_arrivals[j]["scheduled_arrival_time"] > arrival["scheduled_arrival_time"]
-                        for j in range(i + 1, len(route_arrivals))
-                    )
-                    if not has_realtime_after:
-                        filtered.append(arrival)
+                    kept.append(arrival)
+                    if latest_realtime is None:
+                        latest_realtime = arrival["scheduled_arrival_time"]
+                elif latest_realtime is None or not latest_realtime > arrival["scheduled_arrival_time"]:
+                    kept.append(arrival)
+            kept.reverse()
+            filtered.extend(kept)
 
         return filtered
 
     def get_future_metro_arrivals(self, stop_code: str):
-        now = datetime.now()
+        now_sec = self._seconds_of_day(datetime.now())
 
         all_arrivals = (
-            self.db.query(StopTime, Trip)
+            self.db.query(*self._ARRIVAL_COLUMNS)
             .join(Trip, Trip.trip_id == StopTime.trip_id)
+            .outerjoin(RealisticStopTime, self._REALISTIC_JOIN)
             .filter(StopTime.stop_id == stop_code)
-            .order_by(StopTime.arrival_time)
+            .order_by(StopTime.arrival_sec)
             .all()
         )
 
-        # Batch query realistic stop times for metro
-        trip_ids = [a.trip_id for a, _ in all_arrivals]
-        realistic_times = {}
-        if trip_ids:
-            realistic_results = (
-                self.db.query(RealisticStopTime)
-                .filter(
-                    RealisticStopTime.trip_id.in_(trip_ids),
-                    RealisticStopTime.stop_id == stop_code
-                )
-                .all()
-            )
-            for r in realistic_results:
-                key = (r.trip_id, r.stop_id, r.stop_sequence)
-                realistic_times[key] = r.arrival_time
-
         output = []
 
-        for a, trip in all_arrivals:
-            if self.seconds_until(a.arrival_time) <= 0:
+        for a in all_arrivals:
+            if a.arrival_sec is None or a.arrival_sec - now_sec <= 0:
                 continue
 
-            route_code = a.trip_id.split("-")[0]
+            route_code = a.trip_id.partition("-")[0]
             real_life_route_id = self.routes_service.get_reallife_id(route_code)
 
-            # Calculate historic latency using pre-fetched data
-            historic_latency, historic_relationship = self._calculate_historic_latency_from_cache(
-                a.arrival_time, a.trip_id, a.stop_id, a.stop_sequence, realistic_times
+            # Calculate historic latency using the joined realistic time
+            historic_latency, historic_relationship = self._calculate_historic_latency(
+                a.arrival_sec, a.realistic_arrival_sec
             )
 
             arrival_obj = {
@@ -360,7 +441,7 @@ class StopsService:
                 "departure_time": a.departure_time,
                 "stop_sequence": a.stop_sequence,
                 "stop_headsign": a.stop_headsign,
-                "trip_headsign": trip.trip_headsign,
+                "trip_headsign": a.trip_headsign,
                 "vehicle_position": None,
                 "vehicle_id": None,
                 "certainty": "scheduled",
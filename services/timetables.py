@@ -2,8 +2,51 @@ from sqlalchemy.orm import Session
 from db.models import Stop, RealisticStopTime, Route, Trip, TimetableEntry, CalendarDate
 from db.connection import engine
 from collections import defaultdict
-from typing import Dict, List
+from typing import Dict, List, NamedTuple, Set
 from datetime import datetime, timedelta
+from sys import intern
+import numpy as np
+
+# Rows fetched per round trip while streaming realistic stop times
+STOP_TIMES_BATCH_SIZE = 5000
+
+# Stands in for a missing time in the int32 seconds columns
+NO_TIME = -1
+
+
+class TripStopTimes(NamedTuple):
+    """
+    One trip's stop times as parallel columns ordered by stop_sequence, instead
+    of a row object per stop. Times are also kept as strings for responses.
+    Stop ids and time strings are interned: a feed has a few thousand distinct
+    values repeated across millions of rows.
+    """
+    stop_ids: List[str]
+    stop_sequences: List[int]
+    arrival_times: List[str]
+    departure_times: List[str]
+    arrival_secs: np.ndarray  # int32, NO_TIME where missing
+    departure_secs: np.ndarray  # int32, NO_TIME where missing
+
+    @classmethod
+    def from_rows(cls, rows) -> "TripStopTimes":
+        return cls(
+            [intern(r.stop_id) for r in rows],
+            [r.stop_sequence for r in rows],
+            [r.arrival_time and intern(r.arrival_time) for r in rows],
+            [r.departure_time and intern(r.departure_time) for r in rows],
+            np.array([NO_TIME if r.arrival_sec is None else r.arrival_sec for r in rows], dtype=np.int32),
+            np.array([NO_TIME if r.departure_sec is None else r.departure_sec for r in rows], dtype=np.int32),
+        )
+
+
+def service_date(now: datetime | None = None) -> str:
+    """YYYYMMDD of the service day; before 4:20 AM that is still yesterday"""
+    now = now or datetime.now()
+    if now.hour < 4 or (now.hour == 4 and now.minute < 20):
+        return (now - timedelta(days=1)).strftime("%Y%m%d")
+    return now.strftime("%Y%m%d")
+
 
 class Timetables:
     """
@@ -17,14 +60,21 @@ class Timetables:
         self.stops: Dict[str, Dict] = {}
         # trips: trip_id -> Trip model
         self.trips: Dict[str, Trip] = {}
-        # stop_times_by_trip: trip_id -> [RealisticStopTime models ordered by stop_sequence]
-        self.stop_times_by_trip: Dict[str, List[RealisticStopTime]] = defaultdict(list)
+        # stop_times_by_trip: trip_id -> realistic stop times as TripStopTimes columns
+        self.stop_times_by_trip: Dict[str, TripStopTimes] = {}
         # routes: route_id -> Route model
         self.routes: Dict[str, Route] = {}
-        # stop_routes: stop_id -> list of route_ids passing through
-        self.stop_routes: Dict[str, List[str]] = defaultdict(list)
+        # stop_routes: stop_id -> route_ids passing through
+        self.stop_routes: Dict[str, Set[str]] = defaultdict(set)
+        # trips_by_stop: stop_id -> trip_ids serving it (each trip once)
+        self.trips_by_stop: Dict[str, List[str]] = defaultdict(list)
 
     def load(self):
+        self.load_static()
+        self.load_stop_times()
+
+    def load_static(self):
+        """Stops, routes and trips; these don't depend on realistic_stop_times"""
         # Load stops
         self._load_stops()
         
@@ -33,9 +83,17 @@ class Timetables:
         
         # Load trips
         self._load_trips()
-        
+
+    def load_stop_times(self, cached: Dict[str, np.ndarray] | None = None):
+        """
+        Realistic stop times and the indexes built from them (after load_static).
+        cached: arrays saved from stop_times_arrays() to use instead of the database
+        """
         # Load stop_times (realistic)
-        self._load_stop_times()
+        if cached is None:
+            self._load_stop_times()
+        else:
+            self._load_stop_times_arrays(cached)
 
         print(f"Loaded {len(self.stops)} stops, {len(self.routes)} routes, {len(self.trips)} trips into timetable.")
         
@@ -63,58 +121,134 @@ class Timetables:
 
     def _load_stop_times(self):
         # Changed to query RealisticStopTime instead of StopTime
-        now = datetime.now()
-
         # If it's before 4:20 AM, use yesterday's date for service lookup
-        if now.hour < 4 or (now.hour == 4 and now.minute < 20):
-            service_date = (now - timedelta(days=1)).strftime("%Y%m%d")
-        else:
-            service_date = now.strftime("%Y%m%d")
+        day = service_date()
 
+        # Plain rows with just the columns routing reads, not ORM objects,
+        # streamed in batches from a server-side cursor instead of one big list
         stop_times_query = (
-            self.db.query(RealisticStopTime)
+            self.db.query(
+                RealisticStopTime.trip_id,
+                RealisticStopTime.stop_id,
+                RealisticStopTime.stop_sequence,
+                RealisticStopTime.arrival_time,
+                RealisticStopTime.departure_time,
+                RealisticStopTime.arrival_sec,
+                RealisticStopTime.departure_sec,
+            )
             .join(Trip, Trip.trip_id == RealisticStopTime.trip_id)
             .join(CalendarDate, CalendarDate.service_id == Trip.service_id)
-            .filter(CalendarDate.date == service_date)
+            .filter(CalendarDate.date == day)
             .filter(CalendarDate.exception_type == "1")
             .order_by(
                 RealisticStopTime.trip_id, 
                 RealisticStopTime.stop_sequence
             )
-            .all()
+            .yield_per(STOP_TIMES_BATCH_SIZE)
         )
 
 
+        # Rows come grouped by trip; each trip's rows become one set of columns
+        trip_rows = []
         for st in stop_times_query:
-            self.stop_times_by_trip[st.trip_id].append(st)
-            
+            if trip_rows and trip_rows[-1].trip_id != st.trip_id:
+                self._add_trip_stop_times(trip_rows[-1].trip_id, TripStopTimes.from_rows(trip_rows))
+                trip_rows = []
+            trip_rows.append(st)
+
+        if trip_rows:
+            self._add_trip_stop_times(trip_rows[-1].trip_id, TripStopTimes.from_rows(trip_rows))
+
+    def _add_trip_stop_times(self, trip_id: str, stop_times: TripStopTimes):
+        self.stop_times_by_trip[trip_id] = stop_times
+        trip = self.trips.get(trip_id)
+        for stop_id in stop_times.stop_ids:
             # Also track which routes pass through each stop
-            if st.trip_id in self.trips:
-                route_id = self.trips[st.trip_id].route_id
-                if route_id not in self.stop_routes[st.stop_id]:
-                    self.stop_routes[st.stop_id].append(route_id)
-                    
+            if trip is not None:
+                self.stop_routes[stop_id].add(trip.route_id)
+
+            # Trips are added one at a time, so a repeat visit is always the last entry
+            stop_trips = self.trips_by_stop[stop_id]
+            if not stop_trips or stop_trips[-1] != trip_id:
+                stop_trips.append(trip_id)
+
+    def stop_times_arrays(self) -> Dict[str, np.ndarray]:
+        """
+        stop_times_by_trip as plain arrays (for np.savez): the stop times of
+        trip_ids[i] are rows trip_ptr[i]:trip_ptr[i + 1] of the other columns.
+        Missing time strings are stored as "" and flagged in *_missing.
+        """
+        trips = list(self.stop_times_by_trip.items())
+        trip_ptr = np.zeros(len(trips) + 1, dtype=np.int64)
+        np.cumsum([len(st.stop_ids) for _, st in trips], out=trip_ptr[1:])
+
+        arrays = {
+            "trip_ids": np.array([trip_id for trip_id, _ in trips], dtype=str),
+            "trip_ptr": trip_ptr,
+            "stop_ids": np.array([s for _, st in trips for s in st.stop_ids], dtype=str),
+            "stop_sequences": np.array([s for _, st in trips for s in st.stop_sequences], dtype=np.int64),
+        }
+        for column in ("arrival_times", "departure_times"):
+            values = [v for _, st in trips for v in getattr(st, column)]
+            arrays[column] = np.array(["" if v is None else v for v in values], dtype=str)
+            arrays[f"{column}_missing"] = np.array([v is None for v in values], dtype=bool)
+        for column in ("arrival_secs", "departure_secs"):
+            arrays[column] = np.concatenate(
+                [getattr(st, column) for _, st in trips] or [np.empty(0, dtype=np.int32)]
+            )
+        return arrays
+
+    def _load_stop_times_arrays(self, arrays: Dict[str, np.ndarray]):
+        """stop_times_by_trip and its indexes from stop_times_arrays() output"""
+        def strings(column):
+            missing = arrays[f"{column}_missing"].tolist()
+            return [None if m else intern(v) for v, m in zip(arrays[column].tolist(), missing)]
+
+        trip_ptr = arrays["trip_ptr"].tolist()
+        stop_ids = [intern(s) for s in arrays["stop_ids"].tolist()]
+        stop_sequences = arrays["stop_sequences"].tolist()
+        arrival_times = strings("arrival_times")
+        departure_times = strings("departure_times")
+        arrival_secs = arrays["arrival_secs"].astype(np.int32, copy=False)
+        departure_secs = arrays["departure_secs"].astype(np.int32, copy=False)
+
+        for i, trip_id in enumerate(arrays["trip_ids"].tolist()):
+            start, end = trip_ptr[i], trip_ptr[i + 1]
+            self._add_trip_stop_times(trip_id, TripStopTimes(
+                stop_ids[start:end],
+                stop_sequences[start:end],
+                arrival_times[start:end],
+                departure_times[start:end],
+                arrival_secs[start:end],
+                departure_secs[start:end],
+            ))
+
     def save_to_db(self):
         """
         Persist in-memory timetable into the 'timetable' table.
         """
         
 
-        entries = []
+        # Plain dicts through a Core insert; no ORM objects or unit of work
+        rows = []
         for trip_id, stop_times in self.stop_times_by_trip.items():
             route_id = self.trips[trip_id].route_id if trip_id in self.trips else None
-            for st in stop_times:
-                entry = TimetableEntry(
-                    trip_id=trip_id,
-                    route_id=route_id,
-                    stop_id=st.stop_id,
-                    stop_sequence=st.stop_sequence,
-                    arrival_time=st.arrival_time,
-                    departure_time=st.departure_time
-                )
-                entries.append(entry)
-
-        # Bulk insert
-        self.db.bulk_save_objects(entries)
+            for stop_id, stop_sequence, arrival_time, departure_time in zip(
+                stop_times.stop_ids,
+                stop_times.stop_sequences,
+                stop_times.arrival_times,
+                stop_times.departure_times,
+            ):
+                rows.append({
+                    "trip_id": trip_id,
+                    "route_id": route_id,
+                    "stop_id": stop_id,
+                    "stop_sequence": stop_sequence,
+                    "arrival_time": arrival_time,
+                    "departure_time": departure_time,
+                })
+
+        if rows:
+            self.db.execute(TimetableEntry.__table__.insert(), rows)
         self.db.commit()
-        print(f"Saved {len(entries)} timetable entries to the database.")
\ No newline at end of file
+        print(f"Saved {len(rows)} timetable entries to the database.")
@@ -1,9 +1,13 @@
 import requests
-from google.transit import gtfs_realtime_pb2
-import json
+import os
+from services.gtfs_rt import gtfs_realtime_pb2
+import orjson
 
 TRIP_UPDATES_URL = "https://gtfs.sofiatraffic.bg/api/v1/trip-updates"
 
+# Set GTFS_RT_DEBUG to dump every decoded feed to trip_updates_debug.json
+GTFS_RT_DEBUG = bool(os.environ.get("GTFS_RT_DEBUG"))
+
 def fetch_trip_updates() -> dict:
     """
     Returns:
@@ -62,8 +66,8 @@ def fetch_trip_updates() -> dict:
 
         trip_updates[t_id] = stops
 
-    #print trip updates ina file
-    with open("trip_updates_debug.json", "w") as f:
-        json.dump(trip_updates, f, indent=2)
+    if GTFS_RT_DEBUG:
+        with open("trip_updates_debug.json", "wb") as f:
+            f.write(orjson.dumps(trip_updates))
 
     return trip_updates
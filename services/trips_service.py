@@ -1,3 +1,4 @@
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from db.models import StopTime
 from services.vehicle_positions import fetch_vehicle_positions
@@ -15,17 +16,17 @@ class TripsService:
         base_trip_id = trip_id
 
         # Fetch all stoptimes that match this base_trip_id
-        stoptimes = (
-            self.db.query(StopTime)
-            .filter(StopTime.trip_id.like(f"{base_trip_id}%"))
+        stoptimes = self.db.execute(
+            select(
+                StopTime.stop_id,
+                StopTime.arrival_time,
+                StopTime.departure_time,
+                StopTime.stop_sequence,
+                StopTime.stop_headsign,
+            )
+            .where(StopTime.trip_id.like(f"{base_trip_id}%"))
             .order_by(StopTime.stop_sequence)
-            .all()
-        )
-
-        print(f"DEBUG: base_trip_id = {base_trip_id}")
-        print(f"DEBUG: Found {len(stoptimes)} stoptimes")
-        for st in stoptimes:
-            print(f"  - {st.stop_id} at seq {st.stop_sequence}")
+        ).mappings().all()
 
         if not stoptimes:
             return None
@@ -34,17 +35,8 @@ class TripsService:
         vehicle_positions = fetch_vehicle_positions()
         vehicle_position = vehicle_positions.get(trip_id)  # may be None
 
-        # Build stops list
-        stops = [
-            {
-                "stop_id": st.stop_id,
-                "arrival_time": st.arrival_time,
-                "departure_time": st.departure_time,
-                "stop_sequence": st.stop_sequence,
-                "stop_headsign": st.stop_headsign,
-            }
-            for st in stoptimes
-        ]
+        # The select already has exactly the columns of a stop entry
+        stops = stoptimes
 
         return {
             "trip_id": trip_id,
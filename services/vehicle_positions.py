@@ -1,9 +1,26 @@
 import requests
 import logging
-from google.transit import gtfs_realtime_pb2
+import os
+import time
+from threading import Event, Lock
+from services.gtfs_rt import gtfs_realtime_pb2
 
 VEHICLE_POSITIONS_URL = "https://gtfs.sofiatraffic.bg/api/v1/vehicle-positions"
 
+# Requests within this many seconds of the last fetch share its result
+POSITIONS_CACHE_SECONDS = 15
+
+# How long a caller with nothing cached waits for someone else's fetch
+POSITIONS_WAIT_SECONDS = 10
+
+# Set GTFS_RT_DEBUG to log every decoded vehicle entity
+GTFS_RT_DEBUG = bool(os.environ.get("GTFS_RT_DEBUG"))
+
+# "refreshing" is the Event of the fetch in flight, if any; the lock only
+# guards reads and swaps of these fields, never the HTTP call itself
+_positions_cache = {"fetched_at": None, "positions": {}, "refreshing": None}
+_positions_lock = Lock()
+
 # Setup logging
 logging.basicConfig(
     filename="vehicle_positions.log",
@@ -20,31 +37,75 @@ def fetch_vehicle_positions() -> dict:
                 lat, lon, bearing, speed, vehicle_id
             }
         }
+
+    Cached for POSITIONS_CACHE_SECONDS. Once it expires, one caller fetches
+    the feed while the others keep getting the previous one; only when nothing
+    was fetched yet do they wait for that fetch.
+    """
+    with _positions_lock:
+        fetched_at = _positions_cache["fetched_at"]
+        if fetched_at is not None and time.monotonic() - fetched_at < POSITIONS_CACHE_SECONDS:
+            return _positions_cache["positions"]
+
+        refreshing = _positions_cache["refreshing"]
+        if refreshing is not None and fetched_at is not None:
+            # Someone is already fetching; serve the previous feed meanwhile
+            return _positions_cache["positions"]
+        fetching = refreshing is None
+        if fetching:
+            refreshing = _positions_cache["refreshing"] = Event()
+
+    if not fetching:
+        # Nothing cached yet: wait for the fetch in flight
+        refreshing.wait(POSITIONS_WAIT_SECONDS)
+        return _positions_cache["positions"]
+
+    try:
+        _refresh_positions()
+    finally:
+        with _positions_lock:
+            _positions_cache["refreshing"] = None
+        refreshing.set()
+    return _positions_cache["positions"]
+
+
+def _refresh_positions() -> None:
+    # Fetched outside the lock so requests keep reading the previous feed
+    publish_vehicle_positions(_fetch_vehicle_positions())
+
+
+def publish_vehicle_positions(positions: dict) -> None:
+    """
+    Store positions decoded elsewhere as the current feed. The arrival logger
+    polls the same feed and publishes every one it parses, so requests
+    normally find a fresh cache and this module only fetches when it stalls.
     """
+    with _positions_lock:
+        _positions_cache["fetched_at"] = time.monotonic()
+        _positions_cache["positions"] = positions
+
+
+def touch_vehicle_positions() -> None:
+    """The feed was reported unchanged (304): the published positions are still current"""
+    with _positions_lock:
+        if _positions_cache["fetched_at"] is not None:
+            _positions_cache["fetched_at"] = time.monotonic()
+
+
+def _fetch_vehicle_positions() -> dict:
     response = requests.get(VEHICLE_POSITIONS_URL, timeout=10)
     response.raise_for_status()
 
     feed = gtfs_realtime_pb2.FeedMessage()
     feed.ParseFromString(response.content)
+    return positions_from_feed(feed)
 
+
+def positions_from_feed(feed) -> dict:
+    """trip_id -> position of every positioned vehicle on a trip in a decoded feed"""
     # Log the raw decoded protobuf for inspection
-    logging.debug("Decoded vehicle positions feed:")
-    for entity in feed.entity:
-        if entity.HasField("vehicle"):
-            vehicle = entity.vehicle
-            trip_dict = {f.name: getattr(vehicle.trip, f.name) for f, _ in vehicle.trip.ListFields()}
-            vehicle_info = {
-                "trip": trip_dict,
-                "vehicle_id": vehicle.vehicle.id if vehicle.HasField("vehicle") else None,
-                "position": {
-                    "lat": vehicle.position.latitude,
-                    "lon": vehicle.position.longitude,
-                    "bearing": vehicle.position.bearing if vehicle.position.HasField("bearing") else None,
-                    "speed": vehicle.position.speed if vehicle.position.HasField("speed") else None,
-                } if vehicle.HasField("position") else None,
-            }
-            logging.debug("Vehicle entity: %s", vehicle_info)
-    
+    if GTFS_RT_DEBUG and logging.getLogger().isEnabledFor(logging.DEBUG):
+        _log_feed(feed)
 
     positions = {}
 
@@ -64,4 +125,23 @@ def fetch_vehicle_positions() -> dict:
             "vehicle_id": vehicle.vehicle.id if vehicle.HasField("vehicle") else None,
         }
 
-    return positions
\ No newline at end of file
+    return positions
+
+
+def _log_feed(feed) -> None:
+    logging.debug("Decoded vehicle positions feed:")
+    for entity in feed.entity:
+        if entity.HasField("vehicle"):
+            vehicle = entity.vehicle
+            trip_dict = {f.name: getattr(vehicle.trip, f.name) for f, _ in vehicle.trip.ListFields()}
+            vehicle_info = {
+                "trip": trip_dict,
+                "vehicle_id": vehicle.vehicle.id if vehicle.HasField("vehicle") else None,
+                "position": {
+                    "lat": vehicle.position.latitude,
+                    "lon": vehicle.position.longitude,
+                    "bearing": vehicle.position.bearing if vehicle.position.HasField("bearing") else None,
+                    "speed": vehicle.position.speed if vehicle.position.HasField("speed") else None,
+                } if vehicle.HasField("position") else None,
+            }
+            logging.debug("Vehicle entity: %s", vehicle_info)
@@ -1,11 +1,16 @@
 import os
 import csv
+import json
+import hashlib
 import zipfile
 import shutil
 import requests
 import psycopg2
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
 from sqlalchemy.orm import Session
-from db.models import Stop, StopTime, Trip, Route
+from db.models import Stop, StopTime, Trip, Route, COPY_CHUNK_BYTES, csv_table_columns, post_load_ddl
 from collections import defaultdict
 from dotenv import load_dotenv
 
@@ -15,6 +20,20 @@ GTFS_DIR = "gtfs_static"
 GTFS_ZIP_URL = "https://gtfs.sofiatraffic.bg/api/v1/static"
 GTFS_ZIP_PATH = "gtfs_static.zip"
 
+# HTTP validators of the extracted feed and what was last loaded from it
+GTFS_META_PATH = os.path.join(GTFS_DIR, ".cache_meta.json")
+
+# The timetable's realistic stop times from the last startup as plain arrays
+# (Timetables.stop_times_arrays), see startup_fingerprint() for what
+# invalidates it. Lives in GTFS_DIR, so a new feed drops it.
+TIMETABLE_CACHE_PATH = os.path.join(GTFS_DIR, "timetable_cache.npz")
+
+# Bump when the arrays in the timetable cache change shape or meaning
+TIMETABLE_CACHE_VERSION = 1
+
+# The archive is written to disk as it arrives, this much at a time
+DOWNLOAD_CHUNK_BYTES = 1 << 20
+
 DB_NAME = "gtfs_static"
 DB_ADMIN_CONFIG = {
     "dbname": "postgres",
@@ -29,7 +48,7 @@ DB_CONFIG = {
     "dbname": DB_NAME,
 }
 
-REQUIRED_GTFS_FILES = {
+REQUIRED_GTFS_FILES = frozenset({
     "agency.txt",
     "stops.txt",
     "routes.txt",
@@ -43,37 +62,123 @@ REQUIRED_GTFS_FILES = {
     "feed_info.txt",
     "transfers.txt",
     "translations.txt",
-}
+})
+
+# Files the API actually queries; the rest are only loaded with LOAD_ALL_GTFS=1
+ESSENTIAL_GTFS_FILES = frozenset({
+    "agency.txt",
+    "stops.txt",
+    "routes.txt",
+    "trips.txt",
+    "stop_times.txt",
+    "calendar_dates.txt",
+})
+OPTIONAL_GTFS_FILES = REQUIRED_GTFS_FILES - ESSENTIAL_GTFS_FILES
+
+# Files COPYed at once, each on its own connection
+LOAD_WORKERS = min(len(REQUIRED_GTFS_FILES), os.cpu_count() or 1)
+
+# Per-connection memory for the post-load index builds (times LOAD_WORKERS)
+LOAD_MAINTENANCE_WORK_MEM = "256MB"
 
 
 # ---------- GTFS FILE HANDLING ----------
 
 def gtfs_files_exist() -> bool:
-    if not os.path.isdir(GTFS_DIR):
+    # One directory listing instead of a stat per required file
+    try:
+        with os.scandir(GTFS_DIR) as entries:
+            present = {entry.name for entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
         return False
-    return all(os.path.exists(os.path.join(GTFS_DIR, f)) for f in REQUIRED_GTFS_FILES)
+
+    missing = REQUIRED_GTFS_FILES - present
+    if missing:
+        print(f"Missing GTFS files: {', '.join(sorted(missing))}")
+    return not missing
 
 
-def download_gtfs_zip():
-    print("Downloading GTFS static data...")
-    r = requests.get(GTFS_ZIP_URL, timeout=30)
-    r.raise_for_status()
-    with open(GTFS_ZIP_PATH, "wb") as f:
-        f.write(r.content)
+def read_gtfs_meta() -> dict:
+    try:
+        with open(GTFS_META_PATH, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def write_gtfs_meta(meta: dict):
+    with open(GTFS_META_PATH, "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+
+def download_gtfs_zip(meta: dict | None = None) -> dict | None:
+    """
+    Download the feed zip. Given the meta of the feed on disk the request is
+    conditional, and None is returned when the server reports it unchanged.
+    Returns the new feed's validators and content hash otherwise.
+    """
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+
+    with requests.get(GTFS_ZIP_URL, headers=headers, stream=True, timeout=30) as r:
+        if r.status_code == 304:
+            print("GTFS feed not modified since the last download.")
+            return None
+        r.raise_for_status()
+        print("Downloading GTFS static data...")
+        # Hashed as it streams, to tell a re-sent but identical feed apart
+        content_hash = hashlib.blake2b(digest_size=16)
+        with open(GTFS_ZIP_PATH, "wb") as f:
+            for chunk in r.iter_content(chunk_size=DOWNLOAD_CHUNK_BYTES):
+                f.write(chunk)
+                content_hash.update(chunk)
+        return {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "content_hash": content_hash.hexdigest(),
+        }
 
 
 def extract_gtfs_zip():
     print("Extracting GTFS static data...")
-    if os.path.exists(GTFS_DIR):
-        shutil.rmtree(GTFS_DIR)
-    os.makedirs(GTFS_DIR, exist_ok=True)
+    # Extract next to GTFS_DIR and swap it in with renames, so a failed
+    # extraction leaves the previous files in place
+    new_dir, old_dir = GTFS_DIR + ".new", GTFS_DIR + ".old"
+    shutil.rmtree(new_dir, ignore_errors=True)
+    os.makedirs(new_dir)
 
     with zipfile.ZipFile(GTFS_ZIP_PATH, "r") as zip_ref:
-        zip_ref.extractall(GTFS_DIR)
+        members = [info for info in zip_ref.infolist() if not info.is_dir()]
+        # Directories first, so concurrent extracts never race to create them
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                zip_ref.extract(info, new_dir)
+
+    # Each member is its own DEFLATE stream and zlib releases the GIL, so
+    # stop_times.txt decompresses alongside the rest instead of after it
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        for _ in pool.map(_extract_member, members, repeat(new_dir)):
+            pass
+
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(GTFS_DIR):
+        os.rename(GTFS_DIR, old_dir)
+    os.rename(new_dir, GTFS_DIR)
+    shutil.rmtree(old_dir, ignore_errors=True)
 
     os.remove(GTFS_ZIP_PATH)
 
 
+def _extract_member(info: zipfile.ZipInfo, target_dir: str):
+    # A ZipFile per worker, so the threads don't share one file position
+    with zipfile.ZipFile(GTFS_ZIP_PATH, "r") as zip_ref:
+        zip_ref.extract(info, target_dir)
+
+
 # ---------- DATABASE ----------
 
 def ensure_database_exists():
@@ -102,66 +207,168 @@ def get_db_connection():
     return psycopg2.connect(**DB_CONFIG)
 
 
-def create_table_from_csv(cursor, table_name: str, csv_path: str):
-    with open(csv_path, newline="", encoding="utf-8") as f:
-        reader = csv.reader(f)
-        headers = next(reader)
+def create_table_from_csv(cursor, table_name: str, f):
+    """Create the table from the header of the open (binary) CSV file f"""
+    # Just the header line goes through the csv module; the file is rewound
+    # so the same handle feeds the COPY
+    headers = next(csv.reader([f.readline().decode("utf-8")]))
+    f.seek(0)
 
-    columns = ", ".join(f'"{h}" TEXT' for h in headers)
+    columns = csv_table_columns(table_name, headers)
 
+    # A regular (logged) table, so it survives a Postgres crash. It is created
+    # in the same transaction as its COPY, which lets wal_level=minimal skip
+    # WAL for the load; synchronous_commit=off and indexing after the COPY
+    # (see load_gtfs_file) keep the rest of the cost down
     cursor.execute(f"""
         DROP TABLE IF EXISTS "{table_name}";
         CREATE TABLE "{table_name}" (
             {columns}
         );
     """)
+    return headers
+
+
+def load_csv_into_table(cursor, table_name: str, f):
+    cursor.copy_expert(
+        f'COPY "{table_name}" FROM STDIN WITH CSV HEADER',
+        f,
+        size=COPY_CHUNK_BYTES,
+    )
+
+
+def gtfs_files_to_load() -> frozenset:
+    if os.environ.get("LOAD_ALL_GTFS") == "1":
+        return REQUIRED_GTFS_FILES
+    return ESSENTIAL_GTFS_FILES
 
 
-def load_csv_into_table(cursor, table_name: str, csv_path: str):
-    with open(csv_path, "r", encoding="utf-8") as f:
-        cursor.copy_expert(
-            f'COPY "{table_name}" FROM STDIN WITH CSV HEADER',
-            f
+def gtfs_files_fingerprint(files) -> dict:
+    """(size, mtime) per file, to tell whether the files on disk changed"""
+    fingerprint = {}
+    for file_name in sorted(files):
+        st = os.stat(os.path.join(GTFS_DIR, file_name))
+        fingerprint[file_name] = [st.st_size, st.st_mtime_ns]
+    return fingerprint
+
+
+def gtfs_tables_loaded(meta: dict, files) -> bool:
+    """Whether the database still holds these files as they are on disk"""
+    if meta.get("loaded") != gtfs_files_fingerprint(files):
+        return False
+
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        tables = [f.replace(".txt", "") for f in files]
+        cur.execute(
+            "SELECT count(*) FROM pg_tables "
+            "WHERE schemaname = current_schema() AND tablename = ANY(%s)",
+            (tables,),
         )
+        if cur.fetchone()[0] != len(tables):
+            return False
+        # A table can exist and still be empty (e.g. a truncated feed file)
+        cur.execute('SELECT EXISTS (SELECT 1 FROM "stop_times")')
+        return cur.fetchone()[0]
+    finally:
+        conn.close()
 
 
-def load_gtfs_into_db():
+def load_gtfs_into_db(to_load=None):
     print("Loading GTFS data into database...")
-    conn = get_db_connection()
-    cur = conn.cursor()
 
-    for file_name in REQUIRED_GTFS_FILES:
-        table_name = file_name.replace(".txt", "")
-        csv_path = os.path.join(GTFS_DIR, file_name)
+    if to_load is None:
+        to_load = gtfs_files_to_load()
 
-        print(f"  → Importing {file_name} into table '{table_name}'")
-        create_table_from_csv(cur, table_name, csv_path)
-        load_csv_into_table(cur, table_name, csv_path)
+    # Tables are independent, so the COPYs run side by side; largest first,
+    # so stop_times.txt starts right away and the small files fill in around it
+    files = sorted(
+        to_load,
+        key=lambda f: os.path.getsize(os.path.join(GTFS_DIR, f)),
+        reverse=True,
+    )
+    with ThreadPoolExecutor(max_workers=LOAD_WORKERS) as pool:
+        for _ in pool.map(load_gtfs_file, files):
+            pass
 
-    conn.commit()
-    cur.close()
-    conn.close()
     print("GTFS data loaded successfully.")
 
 
-# ---------- ENTRY POINT ----------
+def load_gtfs_file(file_name: str):
+    table_name = file_name.replace(".txt", "")
+    csv_path = os.path.join(GTFS_DIR, file_name)
 
-def run_startup():
-    print("Running startup checks...")
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute("SET synchronous_commit = off")
+        cur.execute("SET maintenance_work_mem = %s", (LOAD_MAINTENANCE_WORK_MEM,))
+        print(f"  → Importing {file_name} into table '{table_name}'")
+        with open(csv_path, "rb", buffering=COPY_CHUNK_BYTES) as f:
+            headers = create_table_from_csv(cur, table_name, f)
+            load_csv_into_table(cur, table_name, f)
+
+        # Index after COPY so the bulk load doesn't maintain the btrees row by row
+        for statement in post_load_ddl(table_name, headers):
+            cur.execute(statement)
+
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+# ---------- TIMETABLE CACHE ----------
+
+def startup_fingerprint(files) -> str:
+    """Hash of everything the realistic stop times and the timetable come from"""
+    import services.realistic_stop_times_service as realistic
+    from services.timetables import service_date
+
+    sources = {
+        "version": TIMETABLE_CACHE_VERSION,
+        "gtfs": gtfs_files_fingerprint(files),
+        "service_date": service_date(),
+    }
+    # The arrival log and the code that turns it into realistic stop times
+    for path in (realistic.LOG_FILE, realistic.__file__):
+        try:
+            st = os.stat(path)
+            sources[path] = [st.st_size, st.st_mtime_ns]
+        except FileNotFoundError:
+            sources[path] = None
+
+    blob = json.dumps(sources, sort_keys=True).encode()
+    return hashlib.blake2b(blob, digest_size=16).hexdigest()
+
+
+def load_timetable_cache(fingerprint: str) -> dict | None:
+    """The cached stop time arrays, if they were saved for these same inputs"""
+    try:
+        # Plain arrays only; allow_pickle=False never runs code from the file
+        with np.load(TIMETABLE_CACHE_PATH, allow_pickle=False) as npz:
+            if npz["fingerprint"].item() != fingerprint:
+                return None
+            return {name: npz[name] for name in npz.files if name != "fingerprint"}
+    except Exception:
+        # Missing, truncated or from an older layout
+        return None
+
+
+def save_timetable_cache(fingerprint: str, timetable):
+    tmp_path = TIMETABLE_CACHE_PATH + ".tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.savez(f, fingerprint=np.array(fingerprint), **timetable.stop_times_arrays())
+        os.replace(tmp_path, TIMETABLE_CACHE_PATH)
+    except Exception as e:
+        print(f"Could not write the timetable cache: {e}")
 
-    # 1️⃣ Ensure GTFS files are present
-    if not gtfs_files_exist():
-        print("GTFS files missing, downloading...")
-        download_gtfs_zip()
-        extract_gtfs_zip()
-    else:
-        print("GTFS files already present.")
 
-    # 2️⃣ Ensure database exists and load GTFS data
-    ensure_database_exists()
-    load_gtfs_into_db()
-    
-    
+# ---------- ENTRY POINT ----------
+
+def run_realistic_stop_times():
     print("Creating realistic_stop_times")
     from services.realistic_stop_times_service import calculate_realistic_stop_times
     print("\n" + "=" * 60)
@@ -181,6 +388,50 @@ def run_startup():
         import traceback
         traceback.print_exc()
 
+
+def run_startup():
+    print("Running startup checks...")
+
+    # 1️⃣ Ensure GTFS files are present and current
+    meta = read_gtfs_meta()
+    if not gtfs_files_exist():
+        print("GTFS files missing, downloading...")
+        meta = download_gtfs_zip()
+        extract_gtfs_zip()
+        write_gtfs_meta(meta)
+    else:
+        # Without validators (the server sends none, or the meta file is
+        # missing) this is a full download, so the feed never goes unchecked
+        print("GTFS files already present, checking for a newer feed...")
+        try:
+            new_meta = download_gtfs_zip(meta)
+        except requests.RequestException as e:
+            print(f"Could not check for a newer feed ({e}), using the files on disk.")
+            new_meta = None
+        if new_meta is not None and new_meta["content_hash"] == meta.get("content_hash"):
+            # Same bytes as the extracted feed: re-extracting would only touch
+            # the files' mtimes and force a full database reload
+            print("Downloaded GTFS feed is identical to the files on disk.")
+            meta.update(new_meta)
+            write_gtfs_meta(meta)
+        elif new_meta is not None:
+            extract_gtfs_zip()
+            meta = new_meta
+            write_gtfs_meta(meta)
+
+    # 2️⃣ Ensure database exists and load GTFS data, unless it already
+    # holds exactly these files
+    ensure_database_exists()
+    files = gtfs_files_to_load()
+    gtfs_reloaded = not gtfs_tables_loaded(meta, files)
+    if not gtfs_reloaded:
+        print("GTFS tables are up to date with the feed, skipping the load.")
+    else:
+        load_gtfs_into_db(files)
+        meta["loaded"] = gtfs_files_fingerprint(files)
+        write_gtfs_meta(meta)
+    
+    
     print("Loading RAPTOR timetable into memory...")
     from sqlalchemy.orm import sessionmaker
     from db.connection import engine
@@ -191,7 +442,25 @@ def run_startup():
     db_session = SessionLocal()
 
     timetable = Timetables(db_session)
-    timetable.load()
+
+    # Same feed, arrival log and service day as last time: the realistic stop
+    # times in the database and the cached arrays are still current
+    fingerprint = startup_fingerprint(files)
+    cached = None if gtfs_reloaded else load_timetable_cache(fingerprint)
+    if cached is not None:
+        print("Inputs unchanged, reusing the cached realistic stop times.")
+        timetable.load_static()
+        timetable.load_stop_times(cached)
+    else:
+        # The realistic stop times are computed in the background while the
+        # timetable loads the stops, routes and trips that don't depend on them
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            realistic_stop_times = pool.submit(run_realistic_stop_times)
+            timetable.load_static()
+            realistic_stop_times.result()
+
+        timetable.load_stop_times()
+        save_timetable_cache(fingerprint, timetable)
 
     # Initialize the service once here
     # This triggers the heavy transfer graph building and route grouping
@@ -8,7 +8,9 @@ import sys
 import logging
 import csv
 from pathlib import Path
+import pandas as pd
 from datetime import datetime
+from itertools import zip_longest
 
 # Setup logging
 logging.basicConfig(
@@ -64,42 +66,50 @@ def analyze_arrival_log():
         return
     
     try:
-        with open(log_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = list(reader)
-            
-            if not rows:
-                logger.warning("arrival_log_cleaned.csv is empty (only headers)")
-                return
-            
-            logger.info(f"Total rows in log: {len(rows)}")
-            
-            # Count valid delay entries
-            valid_delays = [
-                int(row['delay_seconds']) 
-                for row in rows 
-                if row.get('delay_seconds', '').strip() 
-                and row['delay_seconds'].strip().lstrip('-').isdigit()
-            ]
-            
-            if valid_delays:
-                logger.info(f"Valid delay entries: {len(valid_delays)}")
-                logger.info(f"Min delay: {min(valid_delays)} seconds ({min(valid_delays)/60:.1f} minutes)")
-                logger.info(f"Max delay: {max(valid_delays)} seconds ({max(valid_delays)/60:.1f} minutes)")
-                logger.info(f"Avg delay: {sum(valid_delays)/len(valid_delays):.1f} seconds")
-                
-                # Count how many would be filtered
-                filtered = sum(1 for d in valid_delays if abs(d) > 1800)
-                logger.info(f"Entries that will be filtered (>30 min): {filtered}")
-            else:
-                logger.warning("No valid delay entries found in log")
-            
-            # Show sample entries
-            logger.info("\nSample entries (first 3):")
-            for i, row in enumerate(rows[:3], 1):
-                logger.info(f"  {i}. Trip: {row.get('trip_id', 'N/A')}, "
-                          f"Stop: {row.get('stop_id', 'N/A')}, "
-                          f"Delay: {row.get('delay_seconds', 'N/A')}s")
+        # Only the columns reported below, as strings, parsed in C
+        columns = {'trip_id', 'stop_id', 'delay_seconds'}
+        try:
+            df = pd.read_csv(
+                log_file,
+                dtype=str,
+                keep_default_na=False,
+                usecols=lambda c: c in columns,
+            )
+        except pd.errors.EmptyDataError:
+            df = pd.DataFrame()
+
+        if df.empty:
+            logger.warning("arrival_log_cleaned.csv is empty (only headers)")
+            return
+
+        logger.info(f"Total rows in log: {len(df)}")
+
+        # Count valid delay entries
+        if 'delay_seconds' in df:
+            delays = df['delay_seconds'].fillna('').str.strip()
+            valid_delays = delays[delays.str.fullmatch(r'-?\d+')].astype('int64')
+        else:
+            valid_delays = pd.Series(dtype='int64')
+
+        if len(valid_delays):
+            min_delay, max_delay = int(valid_delays.min()), int(valid_delays.max())
+            logger.info(f"Valid delay entries: {len(valid_delays)}")
+            logger.info(f"Min delay: {min_delay} seconds ({min_delay/60:.1f} minutes)")
+            logger.info(f"Max delay: {max_delay} seconds ({max_delay/60:.1f} minutes)")
+            logger.info(f"Avg delay: {valid_delays.mean():.1f} seconds")
+
+            # Count how many would be filtered
+            filtered = int((valid_delays.abs() > 1800).sum())
+            logger.info(f"Entries that will be filtered (>30 min): {filtered}")
+        else:
+            logger.warning("No valid delay entries found in log")
+
+        # Show sample entries
+        logger.info("\nSample entries (first 3):")
+        for i, row in enumerate(df.head(3).to_dict('records'), 1):
+            logger.info(f"  {i}. Trip: {row.get('trip_id', 'N/A')}, "
+                      f"Stop: {row.get('stop_id', 'N/A')}, "
+                      f"Delay: {row.get('delay_seconds', 'N/A')}s")
     
     except Exception as e:
         logger.error(f"Error analyzing arrival log: {e}")
@@ -190,6 +200,15 @@ def show_statistics():
     logger.info(f"Std deviation: {stats.get('stdev_delay_seconds', 0):.1f} seconds")
 
 
+def _column_index(header, name):
+    return header.index(name) if name in header else None
+
+
+def _field(row, index):
+    # None for a missing column, like DictReader's .get()
+    return row[index] if index is not None and index < len(row) else None
+
+
 def compare_outputs():
     """Compare original and realistic stop times"""
     logger.info("\n" + "=" * 60)
@@ -204,36 +223,59 @@ def compare_outputs():
         return
     
     try:
-        with open(original_file, 'r', encoding='utf-8') as f:
-            original_rows = list(csv.DictReader(f))
-        
-        with open(realistic_file, 'r', encoding='utf-8') as f:
-            realistic_rows = list(csv.DictReader(f))
-        
-        logger.info(f"Original entries: {len(original_rows)}")
-        logger.info(f"Realistic entries: {len(realistic_rows)}")
-        
-        # Count differences
-        differences = 0
-        for orig, real in zip(original_rows[:100], realistic_rows[:100]):
-            if orig.get('arrival_time') != real.get('arrival_time'):
-                differences += 1
-        
+        # Both files are streamed side by side; only the first 100 pairs and
+        # the first 5 differences are needed, the rest is just counted
+        with open(original_file, 'r', newline='', encoding='utf-8') as fa, \
+                open(realistic_file, 'r', newline='', encoding='utf-8') as fb:
+            # Blank lines are skipped, as DictReader does
+            original_reader = (row for row in csv.reader(fa) if row)
+            realistic_reader = (row for row in csv.reader(fb) if row)
+            original_header = next(original_reader, [])
+            realistic_header = next(realistic_reader, [])
+            trip_col = _column_index(original_header, 'trip_id')
+            stop_col = _column_index(original_header, 'stop_id')
+            original_arrival_col = _column_index(original_header, 'arrival_time')
+            realistic_arrival_col = _column_index(realistic_header, 'arrival_time')
+
+            original_count = realistic_count = 0
+            differences = 0
+            samples = []
+            for orig, real in zip_longest(original_reader, realistic_reader):
+                original_count += orig is not None
+                realistic_count += real is not None
+                if orig is None or real is None:
+                    continue
+
+                original_arrival = _field(orig, original_arrival_col)
+                realistic_arrival = _field(real, realistic_arrival_col)
+                if original_arrival != realistic_arrival:
+                    if original_count <= 100:
+                        differences += 1
+                    if len(samples) < 5:
+                        samples.append((
+                            _field(orig, trip_col), _field(orig, stop_col),
+                            original_arrival, realistic_arrival,
+                        ))
+
+                if original_count >= 100 and len(samples) >= 5:
+                    break
+
+            original_count += sum(1 for _ in original_reader)
+            realistic_count += sum(1 for _ in realistic_reader)
+
+        logger.info(f"Original entries: {original_count}")
+        logger.info(f"Realistic entries: {realistic_count}")
+
         logger.info(f"Time differences in first 100 entries: {differences}")
         
         # Show sample comparisons
         logger.info("\nSample comparisons (first 5 with differences):")
-        shown = 0
-        for orig, real in zip(original_rows, realistic_rows):
-            if orig.get('arrival_time') != real.get('arrival_time'):
-                logger.info(f"\n  Trip: {orig.get('trip_id')}, Stop: {orig.get('stop_id')}")
-                logger.info(f"  Original:  {orig.get('arrival_time')}")
-                logger.info(f"  Realistic: {real.get('arrival_time')}")
-                shown += 1
-                if shown >= 5:
-                    break
+        for trip_id, stop_id, original_arrival, realistic_arrival in samples:
+            logger.info(f"\n  Trip: {trip_id}, Stop: {stop_id}")
+            logger.info(f"  Original:  {original_arrival}")
+            logger.info(f"  Realistic: {realistic_arrival}")
         
-        if shown == 0:
+        if not samples:
             logger.info("  No differences found in checked entries")
     
     except Exception as e: